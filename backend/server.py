@@ -1,24 +1,289 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+import httpx
 import os
+import asyncio
+import base64
+import contextvars
+import binascii
+import bisect
+import collections
+import gzip
+import hashlib
+import json
+import heapq
+import itertools
 import logging
+import math
+import random
+import re
+import threading
+import time
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, TypeAdapter
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
 import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
+try:
+    import orjson
+except ImportError:  # optional: FAST_JSON falls back to the stdlib encoder
+    orjson = None
+
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_CONNECT_TIMEOUT_MS = os.environ.get('MONGO_CONNECT_TIMEOUT_MS')
+MONGO_SERVER_SELECTION_TIMEOUT_MS = os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS')
+MONGO_SOCKET_TIMEOUT_MS = os.environ.get('MONGO_SOCKET_TIMEOUT_MS')
+MONGO_MAX_IDLE_TIME_MS = os.environ.get('MONGO_MAX_IDLE_TIME_MS')
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')
+WARM_POOL_CONNECTIONS = int(os.environ.get('WARM_POOL_CONNECTIONS', '10'))
+STARTUP_PRIME_TIMEOUT_SECONDS = float(os.environ.get('STARTUP_PRIME_TIMEOUT_SECONDS', '30'))
+READY_PING_TIMEOUT_MS = float(os.environ.get('READY_PING_TIMEOUT_MS', '1000'))
+AGENT_CACHE_TTL = float(os.environ.get('AGENT_CACHE_TTL', '30'))
+AGENT_CACHE_MAX = int(os.environ.get('AGENT_CACHE_MAX', '100'))
+STATUS_PAGE_MAX = int(os.environ.get('STATUS_PAGE_MAX', '1000'))
+STATUS_BATCH_ENABLED = os.environ.get('STATUS_BATCH_ENABLED', 'false').lower() == 'true'
+STATUS_BATCH_SIZE = int(os.environ.get('STATUS_BATCH_SIZE', '200'))
+STATUS_BATCH_INTERVAL_MS = float(os.environ.get('STATUS_BATCH_INTERVAL_MS', '20'))
+STATUS_BATCH_QUEUE_MAX = int(os.environ.get('STATUS_BATCH_QUEUE_MAX', '10000'))
+FEED_TTL_DAYS = float(os.environ.get('FEED_TTL_DAYS', '7'))
+FEED_SUBSCRIBER_QUEUE = int(os.environ.get('FEED_SUBSCRIBER_QUEUE', '256'))
+FEED_REPLAY_MAX = int(os.environ.get('FEED_REPLAY_MAX', '500'))
+FEED_HEARTBEAT_SECONDS = float(os.environ.get('FEED_HEARTBEAT_SECONDS', '15'))
+SEARCH_MAX_EVENTS = int(os.environ.get('SEARCH_MAX_EVENTS', '50000'))
+SEARCH_PREFIX_BUDGET = int(os.environ.get('SEARCH_PREFIX_BUDGET', '5000'))
+TEMPLATE_CACHE_MAX = int(os.environ.get('TEMPLATE_CACHE_MAX', '1024'))
+STATUS_RETENTION_DAYS = float(os.environ.get('STATUS_RETENTION_DAYS', '30'))
+STATUS_COMPACT_INTERVAL_SECONDS = float(os.environ.get('STATUS_COMPACT_INTERVAL_SECONDS', '600'))
+STANDUP_DECISIONS_MAX = int(os.environ.get('STANDUP_DECISIONS_MAX', '50'))
+ROLLUP_MINUTE_RETENTION_HOURS = float(os.environ.get('ROLLUP_MINUTE_RETENTION_HOURS', '2'))
+ROLLUP_HOUR_RETENTION_DAYS = float(os.environ.get('ROLLUP_HOUR_RETENTION_DAYS', '8'))
+ROLLUP_COMPACT_INTERVAL_SECONDS = float(os.environ.get('ROLLUP_COMPACT_INTERVAL_SECONDS', '300'))
+ROLLUP_FLUSH_INTERVAL_SECONDS = float(os.environ.get('ROLLUP_FLUSH_INTERVAL_SECONDS', '1'))
+AGENT_CHANGES_GRACE_SECONDS = float(os.environ.get('AGENT_CHANGES_GRACE_SECONDS', '5'))
+LLM_WORKERS = int(os.environ.get('LLM_WORKERS', '4'))
+LLM_CONCURRENCY = os.environ.get('LLM_CONCURRENCY', '*=4')
+LLM_RATE_LIMITS = os.environ.get('LLM_RATE_LIMITS', '')
+LLM_LEASE_SECONDS = float(os.environ.get('LLM_LEASE_SECONDS', '60'))
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', '120'))
+LLM_RETRY_BASE_MS = float(os.environ.get('LLM_RETRY_BASE_MS', '500'))
+LLM_RETRY_MAX_MS = float(os.environ.get('LLM_RETRY_MAX_MS', '60000'))
+LLM_POLL_INTERVAL_MS = float(os.environ.get('LLM_POLL_INTERVAL_MS', '500'))
+LLM_FALLBACK_PROVIDER = os.environ.get('LLM_FALLBACK_PROVIDER', '')
+LLM_MODEL_IDS = os.environ.get('LLM_MODEL_IDS', '')
+LLM_STUB_LATENCY_MS = float(os.environ.get('LLM_STUB_LATENCY_MS', '50'))
+LLM_STUB_FAILURE_RATE = float(os.environ.get('LLM_STUB_FAILURE_RATE', '0'))
+JOB_TTL_DAYS = float(os.environ.get('JOB_TTL_DAYS', '7'))
+ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+MOONSHOT_API_KEY = os.environ.get('MOONSHOT_API_KEY')
+FAST_JSON = os.environ.get('FAST_JSON', 'false').lower() == 'true'
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', '1024'))
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '500'))
+SLOW_REQUEST_SAMPLE = float(os.environ.get('SLOW_REQUEST_SAMPLE', '1.0'))
+ADMISSION_CONCURRENCY = os.environ.get('ADMISSION_CONCURRENCY', 'read=64,write=32')
+ADMISSION_QUEUE_BUDGET_MS = float(os.environ.get('ADMISSION_QUEUE_BUDGET_MS', '500'))
+ADMISSION_CLIENT_RATES = os.environ.get('ADMISSION_CLIENT_RATES', '')
+ADMISSION_CLIENT_BURST = float(os.environ.get('ADMISSION_CLIENT_BURST', '2'))
+ADMISSION_CLIENT_HEADER = os.environ.get('ADMISSION_CLIENT_HEADER', '').lower()
+ADMISSION_CLIENTS_MAX = int(os.environ.get('ADMISSION_CLIENTS_MAX', '10000'))
+
+# Identifies events written by this process so change-stream echoes are skipped.
+PROCESS_ID = uuid.uuid4().hex
+
+
+
+# ── Instrumentation ──
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 20, 50)
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    pairs = ",".join('%s="%s"' % (n, str(v).replace("\\", "\\\\").replace('"', '\\"')) for n, v in zip(names, values))
+    return "{%s}" % pairs if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: Dict[Tuple, float] = collections.defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, labels: Tuple = (), amount: float = 1.0):
+        with self.lock:
+            self.values[labels] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...], labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.buckets, self.labels = name, help, buckets, labels
+        # Per label set: non-cumulative bucket counts (last slot is +Inf), sum, count.
+        self.series: Dict[Tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels: Tuple, value: float):
+        with self.lock:
+            entry = self.series.get(labels)
+            if entry is None:
+                entry = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.series.items()):
+                running = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    running += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{format_labels(names, labels + (le,))} {running}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class RequestStats:
+    __slots__ = ("commands", "bytes")
+
+    def __init__(self):
+        self.commands: List[Tuple[str, str, float]] = []
+        self.bytes = 0
+
+
+# Motor runs pymongo on an executor with a copy of the caller's context, so
+# the listener below can see which request issued each command.
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request", default=None)
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "Handler latency.", LATENCY_BUCKETS, ("method", "route"))
+http_response_size = Histogram("http_response_size_bytes", "Response body size.", SIZE_BUCKETS, ("method", "route"))
+http_mongo_commands = Histogram("http_request_mongo_commands", "Mongo commands issued per request.", COUNT_BUCKETS, ("method", "route"))
+mongo_commands = Counter("mongo_commands_total", "Mongo commands by name and outcome.", ("command", "outcome"))
+mongo_latency = Histogram("mongo_command_duration_seconds", "Mongo command round-trip time.", LATENCY_BUCKETS, ("command",))
+llm_jobs = Counter("llm_job_attempts_total", "LLM job attempts by provider, model and outcome.", ("provider", "model", "outcome"))
+llm_job_latency = Histogram("llm_job_duration_seconds", "LLM provider call time per attempt.", LATENCY_BUCKETS, ("provider", "model"))
+http_shed = Counter("http_requests_shed_total", "Requests rejected by admission control.", ("class", "reason"))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self):
+        self.pending: Dict[Tuple, str] = {}
+
+    def started(self, event):
+        if current_request.get() is not None:
+            collection = event.command.get(event.command_name)
+            self.pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event, outcome: str):
+        seconds = event.duration_micros / 1e6
+        mongo_commands.inc((event.command_name, outcome))
+        mongo_latency.observe((event.command_name,), seconds)
+        stats = current_request.get()
+        if stats is not None:
+            collection = self.pending.pop((event.connection_id, event.request_id), "")
+            stats.commands.append((event.command_name, collection, seconds))
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.route_paths: Optional[Dict[Any, str]] = None
+
+    def route_label(self, scope) -> str:
+        if self.route_paths is None:
+            self.route_paths = {r.endpoint: r.path for r in app.routes if hasattr(r, "endpoint")}
+        return self.route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                stats.bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            labels = (scope["method"], self.route_label(scope))
+            http_requests.inc(labels + (status,))
+            http_latency.observe(labels, elapsed)
+            http_response_size.observe(labels, stats.bytes)
+            http_mongo_commands.observe(labels, len(stats.commands))
+            if elapsed * 1000 >= SLOW_REQUEST_MS and random.random() < SLOW_REQUEST_SAMPLE:
+                logger.warning(
+                    "Slow request %s %s -> %s in %.1fms, %d bytes, mongo: %s",
+                    scope["method"], scope["path"], status, elapsed * 1000, stats.bytes,
+                    ", ".join(f"{name}({coll}) {sec * 1000:.1f}ms" for name, coll, sec in stats.commands) or "none",
+                )
+
+
+def mongo_client_options() -> dict:
+    options = {"maxPoolSize": MONGO_MAX_POOL_SIZE, "minPoolSize": MONGO_MIN_POOL_SIZE}
+    # Unset timeouts keep the driver defaults.
+    for key, value in (
+        ("connectTimeoutMS", MONGO_CONNECT_TIMEOUT_MS),
+        ("serverSelectionTimeoutMS", MONGO_SERVER_SELECTION_TIMEOUT_MS),
+        ("socketTimeoutMS", MONGO_SOCKET_TIMEOUT_MS),
+        ("maxIdleTimeMS", MONGO_MAX_IDLE_TIME_MS),
+    ):
+        if value:
+            options[key] = int(value)
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
+
+# Constructing the client does no I/O; the lifespan handler connects it.
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandListener()],
+                            **mongo_client_options())
 db = client[os.environ['DB_NAME']]
 
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 
@@ -42,6 +307,8 @@ class AgentDetail(BaseModel):
     llmModel: str = ""
     systemInstructions: str = ""
     promptTemplates: List[PromptTemplate] = []
+    version: int = 0
+    seq: int = 0
 
 class AgentUpdate(BaseModel):
     name: Optional[str] = None
@@ -52,15 +319,120 @@ class AgentUpdate(BaseModel):
     promptTemplates: Optional[List[PromptTemplate]] = None
     status: Optional[str] = None
 
+class AgentBulkItem(AgentUpdate):
+    id: str
+    version: Optional[int] = None
+
+class AgentBulkFilter(BaseModel):
+    ids: Optional[List[str]] = None
+    llmProvider: Optional[str] = None
+    llmModel: Optional[str] = None
+    status: Optional[str] = None
+
+class AgentBulkUpdate(BaseModel):
+    items: Optional[List[AgentBulkItem]] = Field(None, min_length=1, max_length=500)
+    filter: Optional[AgentBulkFilter] = None
+    update: Optional[AgentUpdate] = None
+
+class JobCreate(BaseModel):
+    agentId: str
+    template: Optional[str] = None
+    variables: Dict[str, Any] = {}
+    prompt: Optional[str] = None
+    maxAttempts: int = Field(3, ge=1, le=10)
+
+class TemplateRenderRequest(BaseModel):
+    template: str
+    variables: List[Dict[str, Any]] = Field(min_length=1, max_length=1000)
+    strict: bool = True
+    stream: bool = False
+
+def now_millis() -> datetime:
+    # BSON dates hold milliseconds; truncating up front keeps a check identical before and after a round trip.
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
 class StatusCheck(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_name: str
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    timestamp: datetime = Field(default_factory=now_millis)
 
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+FEED_TYPES = ("task_created", "task_moved", "comment", "decision", "doc", "status_update")
+
+# Mirrors tabFilterMap in frontend/src/data/mockData.js.
+FEED_TAB_TYPES = {
+    "All": None,
+    "Tasks": ["task_created", "task_moved"],
+    "Comments": ["comment"],
+    "Decisions": ["decision"],
+    "Docs": ["doc"],
+    "Status": ["status_update"],
+}
+
+KANBAN_COLUMNS = {
+    "inbox": "Inbox",
+    "assigned": "Assigned",
+    "in-progress": "In Progress",
+    "review": "Review",
+    "done": "Done",
+}
+COLUMN_PATTERN = "^(" + "|".join(KANBAN_COLUMNS) + ")$"
+PRIORITY_PATTERN = "^(low|medium|high)$"
+
+class Task(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    title: str
+    description: str = ""
+    assigneeId: Optional[str] = None
+    priority: str = "medium"
+    tags: List[str] = []
+    column: str
+    rank: str
+    createdAt: datetime
+    updatedAt: datetime
+    movedAt: Optional[datetime] = None
+
+class TaskCreate(BaseModel):
+    title: str
+    description: str = ""
+    assigneeId: Optional[str] = None
+    priority: str = Field("medium", pattern=PRIORITY_PATTERN)
+    tags: List[str] = []
+    column: str = Field("inbox", pattern=COLUMN_PATTERN)
+    actorId: Optional[str] = None
+
+class TaskUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    assigneeId: Optional[str] = None
+    priority: Optional[str] = Field(None, pattern=PRIORITY_PATTERN)
+    tags: Optional[List[str]] = None
+
+class TaskMoveTarget(BaseModel):
+    column: str = Field(pattern=COLUMN_PATTERN)
+    afterId: Optional[str] = None
+    beforeId: Optional[str] = None
+    actorId: Optional[str] = None
+
+class TaskMove(TaskMoveTarget):
+    id: str
+
+class TaskMoveBatch(BaseModel):
+    moves: List[TaskMove] = Field(min_length=1, max_length=500)
+
+class FeedEventCreate(BaseModel):
+    type: str = Field(pattern="^(" + "|".join(FEED_TYPES) + ")$")
+    agentId: str
+    action: str
+    target: str = ""
+    targetId: Optional[str] = None
+    detail: Optional[str] = None
+
 
 # ── Seed data ──
 
@@ -229,84 +601,2896 @@ SEED_AGENTS = [
 ]
 
 
+SEED_AGENTS_BY_ID = {a["id"]: a for a in SEED_AGENTS}
+
+
+# ── Change sequences ──
+
+class ChangeSequence:
+    """Monotonic per-collection write sequence for delta sync.
+
+    Writers take numbers with a single ``$inc`` on a counter document and
+    stamp each document with its number (``seq``) and the time it was
+    allocated (``seqAt``). Writes can commit out of number order, so readers
+    only advance past numbers allocated at least ``grace`` seconds ago; any
+    write that commits within that window of its allocation is never skipped
+    by a client that syncs to the returned mark.
+    """
+
+    def __init__(self, name: str, grace: float):
+        self.name = name
+        self.grace = grace
+
+    async def allocate(self, count: int = 1) -> Tuple[int, datetime]:
+        """Return the first of ``count`` new numbers and their allocation time."""
+        doc = await db.counters.find_one_and_update(
+            {"_id": self.name}, {"$inc": {"seq": count}}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        # Taken after the counter moved, so it is never earlier than the allocation.
+        return doc["seq"] - count + 1, datetime.now(timezone.utc)
+
+    async def high_water(self) -> Tuple[int, int]:
+        """Return (highest number every earlier write has settled under, highest number allocated)."""
+        counter = await db.counters.find_one({"_id": self.name}, {"seq": 1}) or {}
+        cutoff = datetime.fromtimestamp(time.time() - self.grace, timezone.utc)
+        # Every smaller number was allocated before this one, so at least ``grace`` ago.
+        settled = await db[self.name].find(
+            {"seq": {"$exists": True}, "seqAt": {"$not": {"$gt": cutoff}}}, {"_id": 0, "seq": 1}
+        ).sort("seq", -1).limit(1).to_list(1)
+        return (settled[0]["seq"] if settled else 0), counter.get("seq", 0)
+
+
+agent_seq = ChangeSequence("agents", AGENT_CHANGES_GRACE_SECONDS)
+
+
+# ── Indexes and seeding ──
+
+async def ensure_ttl_index(collection, field: str, seconds: int):
+    try:
+        await collection.create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code != 85:  # IndexOptionsConflict: the TTL changed since the index was built
+            raise
+        await db.command("collMod", collection.name, index={"keyPattern": {field: 1}, "expireAfterSeconds": seconds})
+
+async def dedupe_agents():
+    """Drop duplicate agents left by the old lazy seed race so the unique id index can build."""
+    groups = await db.agents.aggregate([
+        {"$sort": {"version": -1, "_id": -1}},
+        {"$group": {"_id": "$id", "docs": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]).to_list(None)
+    # Keep the most edited copy of each agent.
+    drop = [doc_id for group in groups for doc_id in group["docs"][1:]]
+    if drop:
+        await db.agents.delete_many({"_id": {"$in": drop}})
+        logger.warning("Removed %d duplicate agent documents", len(drop))
+
+async def ensure_indexes():
+    await dedupe_agents()
+    await db.agents.create_index("id", unique=True)
+    await db.agents.create_index("seq")
+    await db.status_checks.create_index([("timestamp", 1), ("id", 1)])
+    await db.status_checks.create_index("compacting", sparse=True)
+    # Raw checks are only stamped compactedAt once their hourly summary is written.
+    await ensure_ttl_index(db.status_checks, "compactedAt", 0)
+    await db.status_summaries.create_index([("hour", 1), ("client_name", 1)], unique=True)
+    await db.status_summaries.create_index([("client_name", 1), ("hour", 1)])
+    await db.tasks.create_index("id", unique=True)
+    await db.tasks.create_index([("column", 1), ("rank", 1), ("id", 1)])
+    await db.events.create_index([("type", 1), ("_id", -1)])
+    await db.events.create_index([("agentId", 1), ("_id", -1)])
+    await ensure_ttl_index(db.events, "createdAt", int(FEED_TTL_DAYS * 86400))
+    await db.jobs.create_index("id", unique=True)
+    # Set only while a job is queued or running, so identical prompts coalesce onto it.
+    await db.jobs.create_index("activeKey", unique=True, sparse=True)
+    await db.jobs.create_index([("status", 1), ("runAt", 1)])
+    await db.jobs.create_index([("status", 1), ("leaseUntil", 1)])
+    await db.jobs.create_index([("agentId", 1), ("_id", -1)])
+    await ensure_ttl_index(db.jobs, "finishedAt", int(JOB_TTL_DAYS * 86400))
+    await db.activity.create_index([("unit", 1), ("start", 1), ("agentId", 1)], unique=True)
+
+async def seed_agents():
+    ops = [UpdateOne({"id": seed["id"]}, {"$setOnInsert": seed}, upsert=True) for seed in SEED_AGENTS]
+    result = await db.agents.bulk_write(ops, ordered=False)
+    if result.upserted_count:
+        logger.info("Seeded %d agents", result.upserted_count)
+
+async def backfill_agent_seq():
+    """Stamp agents written before change sequences existed, including fresh seeds."""
+    missing = await db.agents.find({"seq": {"$exists": False}}, {"_id": 0, "id": 1}).to_list(None)
+    if not missing:
+        return
+    first, at = await agent_seq.allocate(len(missing))
+    ops = [
+        UpdateOne({"id": d["id"], "seq": {"$exists": False}}, {"$set": {"seq": first + i, "seqAt": at}})
+        for i, d in enumerate(missing)
+    ]
+    await db.agents.bulk_write(ops, ordered=False)
+    agent_cache.invalidate()
+
+
+# ── Status checks ──
+
+def format_status_time(ts: datetime) -> str:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def encode_status_check(doc: dict) -> str:
+    """The one wire format for a status check, shared by POST and GET /api/status."""
+    return json.dumps({
+        "id": doc["id"],
+        "client_name": doc["client_name"],
+        "timestamp": format_status_time(doc["timestamp"]),
+    })
+
+
+def encode_cursor(*parts: str) -> str:
+    raw = "|".join(parts).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, count: int) -> List[str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    parts = raw.split("|", count - 1)
+    if len(parts) != count:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return parts
+
+
+def encode_status_cursor(doc: dict) -> str:
+    return encode_cursor(doc["timestamp"].isoformat(), doc["id"])
+
+
+def decode_status_cursor(cursor: str) -> dict:
+    ts, check_id = decode_cursor(cursor, 2)
+    try:
+        ts = datetime.fromisoformat(ts)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"timestamp": {"$gt": ts}},
+        {"timestamp": ts, "id": {"$gt": check_id}},
+    ]}
+
+
+async def migrate_status_timestamps(batch_size: int = 1000):
+    """Convert status checks stored with ISO string timestamps to BSON dates."""
+    migrated = 0
+    while True:
+        docs = await db.status_checks.find(
+            {"timestamp": {"$type": "string"}}, {"_id": 1, "timestamp": 1}
+        ).to_list(batch_size)
+        if not docs:
+            break
+        ops = [
+            UpdateOne({"_id": d["_id"]}, {"$set": {"timestamp": datetime.fromisoformat(d["timestamp"])}})
+            for d in docs
+        ]
+        await db.status_checks.bulk_write(ops, ordered=False)
+        migrated += len(docs)
+    if migrated:
+        logger.info("Migrated %d status check timestamps", migrated)
+
+
+async def migrate_task_ranks():
+    """Re-rank columns still holding ranks from before integer-prefixed keys, keeping their order."""
+    docs = await db.tasks.find({}, {"_id": 0, "id": 1, "column": 1, "rank": 1}).sort(
+        [("column", 1), ("rank", 1), ("id", 1)]).to_list(None)
+    stale = {d["column"] for d in docs if not is_valid_rank(d.get("rank"))}
+    ops, ranks = [], {}
+    for d in docs:
+        if d["column"] in stale:
+            rank = ranks[d["column"]] = rank_between(ranks.get(d["column"]), None)
+            ops.append(UpdateOne({"id": d["id"]}, {"$set": {"rank": rank}}))
+    if ops:
+        await db.tasks.bulk_write(ops, ordered=False)
+        logger.info("Re-ranked %d tasks in %d columns", len(ops), len(stale))
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class StatusWriteBuffer:
+    """Group-commits status checks with insert_many.
+
+    A batch is flushed once it reaches ``max_batch`` documents or
+    ``interval`` seconds after its first document, whichever comes first.
+    ``submit(wait=True)`` resolves after the batch holding the document is
+    acknowledged; ``wait=False`` returns as soon as it is queued.
+    """
+
+    def __init__(self, max_batch: int, interval: float, max_queue: int):
+        self.max_batch = max_batch
+        self.interval = interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batch_sizes = collections.deque(maxlen=1024)
+        self.latencies = collections.deque(maxlen=1024)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None or self.closed:
+            return
+        self.closed = True
+        await self.queue.put(None)
+        await self._task
+        # Submitters blocked on a full queue may have landed behind the sentinel.
+        while True:
+            await asyncio.sleep(0)
+            leftover = []
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is not None:
+                    leftover.append(item)
+            if not leftover:
+                break
+            for i in range(0, len(leftover), self.max_batch):
+                await self._flush(leftover[i:i + self.max_batch])
+
+    async def submit(self, doc: dict, wait: bool = True):
+        if self.closed:
+            await db.status_checks.insert_one(doc)
+            return
+        fut = asyncio.get_running_loop().create_future() if wait else None
+        await self.queue.put((doc, fut))
+        if fut is not None:
+            await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.interval
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        errors: Dict[int, Exception] = {}
+        try:
+            await db.status_checks.insert_many([doc for doc, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                errors[err["index"]] = OperationFailure(err.get("errmsg", "write error"), err.get("code"))
+        except Exception as e:
+            errors = {i: e for i in range(len(batch))}
+        self.flushes += 1
+        self.flushed += len(batch) - len(errors)
+        self.failed += len(errors)
+        self.batch_sizes.append(len(batch))
+        self.latencies.append(time.perf_counter() - started)
+        if errors:
+            logger.error("Status batch flush failed for %d of %d checks", len(errors), len(batch))
+        for i, (_, fut) in enumerate(batch):
+            if fut is None or fut.done():
+                continue
+            if i in errors:
+                fut.set_exception(errors[i])
+            else:
+                fut.set_result(None)
+
+    def stats(self) -> dict:
+        latencies = list(self.latencies)
+        return {
+            "enabled": True,
+            "queueDepth": self.queue.qsize(),
+            "queueMax": self.queue.maxsize,
+            "maxBatch": self.max_batch,
+            "intervalMs": self.interval * 1000,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "avgBatchSize": sum(self.batch_sizes) / len(self.batch_sizes) if self.batch_sizes else 0.0,
+            "flushLatencyMs": {
+                "p50": percentile(latencies, 0.50) * 1000,
+                "p99": percentile(latencies, 0.99) * 1000,
+                "max": max(latencies, default=0.0) * 1000,
+            },
+        }
+
+
+status_buffer = (
+    StatusWriteBuffer(STATUS_BATCH_SIZE, STATUS_BATCH_INTERVAL_MS / 1000, STATUS_BATCH_QUEUE_MAX)
+    if STATUS_BATCH_ENABLED else None
+)
+
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+
+class StatusRetention:
+    """Folds raw status checks past the retention window into hourly summaries.
+
+    Each slice of old checks is tagged with a token, grouped per client and
+    hour in one aggregation, upserted into ``status_summaries`` guarded by
+    that token, and only then stamped ``compactedAt`` for the TTL index to
+    remove. Nothing is deleted before it is counted, and a retried slice is
+    not counted twice.
+    """
+
+    slice_seconds = 86400
+
+    def __init__(self, retention_days: float, interval: float):
+        self.retention = retention_days * 86400
+        self.interval = interval
+
+    @staticmethod
+    def hourly_groups(match: dict) -> List[dict]:
+        return [
+            {"$match": match},
+            {"$group": {
+                "_id": {"client_name": "$client_name",
+                        "hour": {"$dateToString": {"format": HOUR_FORMAT, "date": "$timestamp"}}},
+                "count": {"$sum": 1},
+                "firstSeen": {"$min": "$timestamp"},
+                "lastSeen": {"$max": "$timestamp"},
+            }},
+        ]
+
+    @staticmethod
+    def parse_hour(value: str) -> datetime:
+        return datetime.strptime(value, HOUR_FORMAT).replace(tzinfo=timezone.utc)
+
+    async def _fold_marked(self, token: str) -> int:
+        groups = await db.status_checks.aggregate(self.hourly_groups({"compacting": token})).to_list(None)
+        ops = [
+            UpdateOne(
+                {"hour": self.parse_hour(g["_id"]["hour"]), "client_name": g["_id"]["client_name"],
+                 "folds": {"$ne": token}},
+                {
+                    "$inc": {"count": g["count"]},
+                    "$min": {"firstSeen": g["firstSeen"]},
+                    "$max": {"lastSeen": g["lastSeen"]},
+                    "$push": {"folds": {"$each": [token], "$slice": -ROLLUP_FOLD_MARKS}},
+                },
+                upsert=True,
+            )
+            for g in groups
+        ]
+        await bulk_write_folds(db.status_summaries, ops)
+        await db.status_checks.update_many(
+            {"compacting": token},
+            {"$set": {"compactedAt": datetime.now(timezone.utc)}, "$unset": {"compacting": ""}},
+        )
+        return sum(g["count"] for g in groups)
+
+    async def compact(self) -> int:
+        if self.retention <= 0:
+            return 0
+        folded = 0
+        for token in await db.status_checks.distinct("compacting"):
+            folded += await self._fold_marked(token)
+        cutoff = bucket_start(datetime.fromtimestamp(time.time() - self.retention, timezone.utc), "hour")
+        pending = {"compactedAt": {"$exists": False}, "compacting": {"$exists": False}}
+        while True:
+            oldest = await db.status_checks.find(pending, {"_id": 0, "timestamp": 1}).sort("timestamp", 1).limit(1).to_list(1)
+            if not oldest or oldest[0]["timestamp"] >= cutoff:
+                return folded
+            # Day-sized slices keep each aggregation bounded on a large backlog.
+            slice_end = min(datetime.fromtimestamp(oldest[0]["timestamp"].timestamp() + self.slice_seconds, timezone.utc), cutoff)
+            token = uuid.uuid4().hex
+            await db.status_checks.update_many(
+                {**pending, "timestamp": {"$lt": bucket_start(slice_end, "hour")}},
+                {"$set": {"compacting": token}},
+            )
+            folded += await self._fold_marked(token)
+
+    async def run(self):
+        while True:
+            try:
+                folded = await self.compact()
+                if folded:
+                    logger.info("Compacted %d status checks into hourly summaries", folded)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Status check compaction failed")
+            await asyncio.sleep(self.interval)
+
+    async def history(self, start: datetime, end: datetime, client_name: Optional[str], unit: str) -> List[dict]:
+        """Per-client counts over [start, end), whether the checks are still raw or already summarized."""
+        start = bucket_start(start, "hour")
+        scope = {"client_name": client_name} if client_name else {}
+        summaries = await db.status_summaries.find(
+            {**scope, "hour": {"$gte": start, "$lt": end}}, {"_id": 0, "folds": 0}
+        ).to_list(None)
+        raw = await db.status_checks.aggregate(self.hourly_groups(
+            {**scope, "timestamp": {"$gte": start, "$lt": end}, "compactedAt": {"$exists": False}}
+        )).to_list(None)
+        rows: Dict[Tuple[str, datetime], dict] = {}
+        for name, hour, count, first, last in itertools.chain(
+            ((d["client_name"], d["hour"], d["count"], d["firstSeen"], d["lastSeen"]) for d in summaries),
+            ((g["_id"]["client_name"], self.parse_hour(g["_id"]["hour"]), g["count"], g["firstSeen"], g["lastSeen"])
+             for g in raw),
+        ):
+            key = (name, bucket_start(hour, unit))
+            row = rows.get(key)
+            if row is None:
+                rows[key] = {"client_name": name, "start": key[1], "count": count, "firstSeen": first, "lastSeen": last}
+            else:
+                row["count"] += count
+                row["firstSeen"] = min(row["firstSeen"], first)
+                row["lastSeen"] = max(row["lastSeen"], last)
+        return sorted(rows.values(), key=lambda r: (r["start"], r["client_name"]))
+
+
+status_retention = StatusRetention(STATUS_RETENTION_DAYS, STATUS_COMPACT_INTERVAL_SECONDS)
+
+
+# ── Agent cache ──
+
+agent_list_adapter = TypeAdapter(List[AgentDetail])
+
+AGENT_FIELDS = tuple(AgentDetail.model_fields)
+AGENT_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in AgentDetail.model_fields.items() if not field.is_required()
+}
+AGENT_SUMMARY_FIELDS = ("id", "name", "role", "badge", "badgeColor", "status", "icon", "version")
+
+
+def dumps_json(value) -> bytes:
+    if FAST_JSON and orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def agent_etag(version: int, body: bytes) -> str:
+    # The version prefix lets clients echo a GET ETag back as If-Match.
+    return '"%d-%s"' % (version, hashlib.sha1(body).hexdigest()[:20])
+
+
+def parse_agent_fields(fields: Optional[str], view: Optional[str]) -> Optional[Tuple[str, ...]]:
+    if view == "summary":
+        return AGENT_SUMMARY_FIELDS
+    if view not in (None, "full"):
+        raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted.difference(AGENT_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(f for f in AGENT_FIELDS if f in wanted or f == "id")
+
+
+def trusted_agent(doc: dict) -> AgentDetail:
+    # Documents read back from our own collection were validated on the way in.
+    doc = {**AGENT_DEFAULTS, **doc}
+    doc["promptTemplates"] = [PromptTemplate.model_construct(**t) for t in doc["promptTemplates"]]
+    return AgentDetail.model_construct(**{k: doc[k] for k in AGENT_FIELDS if k in doc})
+
+
+def project_agent(doc: dict, fields: Optional[Tuple[str, ...]]) -> dict:
+    """Shape a (possibly projected) raw agent document without re-validating it."""
+    return {f: doc.get(f, AGENT_DEFAULTS.get(f)) for f in fields or AGENT_FIELDS}
+
+
+class CachedBody:
+    __slots__ = ("body", "etag", "_gzipped")
+
+    def __init__(self, body: bytes, etag: str):
+        self.body = body
+        self.etag = etag
+        self._gzipped: Optional[bytes] = None
+
+    def gzipped(self) -> bytes:
+        # Compressed once per cached body rather than once per response.
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+def parse_if_match(value: Optional[str]) -> Optional[int]:
+    if value is None or value.strip() == "*":
+        return None
+    tag = value.split(",")[0].strip().removeprefix("W/").strip('"')
+    try:
+        return int(tag.split("-", 1)[0])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must carry an agent version")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+def json_response(request: Request, cached: CachedBody) -> Response:
+    body, etag = cached.body, cached.etag
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if len(body) >= GZIP_MIN_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+        # A strong ETag must differ between encodings of the same content.
+        body, etag = cached.gzipped(), etag[:-1] + '-gz"'
+        headers["Content-Encoding"] = "gzip"
+    headers["ETag"] = etag
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class AgentSnapshot:
+    def __init__(self, agents: List[AgentDetail], complete: bool = True):
+        self.loaded_at = time.monotonic()
+        self.agents = {agent.id: agent for agent in agents}
+        # False when the roster outgrew AGENT_CACHE_MAX and only part of it is held.
+        self.complete = complete
+        self._views: Dict[Tuple, CachedBody] = {}
+
+    def list_view(self, fields: Optional[Tuple[str, ...]] = None) -> CachedBody:
+        key = (None, fields)
+        cached = self._views.get(key)
+        if cached is None:
+            include = set(fields) if fields else None
+            body = dumps_json([agent.model_dump(include=include) for agent in self.agents.values()])
+            cached = self._views[key] = CachedBody(body, make_etag(body))
+        return cached
+
+    def agent_view(self, agent_id: str, fields: Optional[Tuple[str, ...]] = None) -> Optional[CachedBody]:
+        key = (agent_id, fields)
+        cached = self._views.get(key)
+        if cached is None:
+            agent = self.agents.get(agent_id)
+            if agent is None:
+                return None
+            body = dumps_json(agent.model_dump(include=set(fields) if fields else None))
+            cached = self._views[key] = CachedBody(body, agent_etag(agent.version, body))
+        return cached
+
+
+class AgentCache:
+    """Serialized snapshot of the agents collection, bounded by a TTL.
+
+    Local writes call ``invalidate``; writes from other workers are picked up
+    through a change stream when the deployment supports one.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.version = 0
+        self._snapshot: Optional[AgentSnapshot] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+        self._snapshot = None
+
+    def _fresh(self) -> Optional[AgentSnapshot]:
+        snap = self._snapshot
+        if snap is not None and time.monotonic() - snap.loaded_at < self.ttl:
+            return snap
+        return None
+
+    async def snapshot(self) -> AgentSnapshot:
+        snap = self._fresh()
+        if snap is not None:
+            return snap
+        async with self._lock:
+            snap = self._fresh()
+            if snap is not None:
+                return snap
+            version = self.version
+            docs = await db.agents.find({}, {"_id": 0}).to_list(AGENT_CACHE_MAX + 1)
+            complete = len(docs) <= AGENT_CACHE_MAX
+            docs = docs[:AGENT_CACHE_MAX]
+            if FAST_JSON:
+                agents = [trusted_agent(doc) for doc in docs]
+            else:
+                agents = agent_list_adapter.validate_python(docs)
+            snap = AgentSnapshot(agents, complete)
+            # A write that landed while we were reading must not be masked.
+            if version == self.version:
+                self._snapshot = snap
+            return snap
+
+    async def get(self, agent_id: str) -> Optional[AgentDetail]:
+        snap = await self.snapshot()
+        agent = snap.agents.get(agent_id)
+        if agent is None and not snap.complete:
+            doc = await db.agents.find_one({"id": agent_id}, {"_id": 0})
+            if doc:
+                agent = trusted_agent(doc) if FAST_JSON else AgentDetail(**doc)
+        return agent
+
+    async def watch(self):
+        while True:
+            try:
+                async with db.agents.watch() as stream:
+                    self.invalidate()
+                    async for _ in stream:
+                        self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                logger.warning("Agent change stream unavailable, relying on cache TTL: %s", e)
+                return
+            except PyMongoError:
+                logger.exception("Agent change stream interrupted, reconnecting")
+                await asyncio.sleep(5)
+
+
+agent_cache = AgentCache(AGENT_CACHE_TTL)
+
+
+# ── Prompt templates ──
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+
+class CompiledTemplate:
+    __slots__ = ("parts", "variables")
+
+    def __init__(self, source: str):
+        # re.split with one group alternates literal text and variable names.
+        self.parts = PLACEHOLDER_RE.split(source)
+        self.variables = tuple(dict.fromkeys(self.parts[1::2]))
+
+    def missing(self, values: Dict[str, Any]) -> List[str]:
+        return [v for v in self.variables if v not in values]
+
+    def render(self, values: Dict[str, Any]) -> str:
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            value = values.get(parts[i])
+            parts[i] = "" if value is None else str(value)
+        return "".join(parts)
+
+
+class TemplateCache:
+    """LRU of compiled templates keyed by agent, template name and content hash.
+
+    Hashing the source means an edited template simply misses and the stale
+    entry ages out; nothing has to be invalidated on save.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: "collections.OrderedDict[Tuple[str, str, str], CompiledTemplate]" = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, agent_id: str, name: str, source: str) -> CompiledTemplate:
+        key = (agent_id, name, hashlib.sha1(source.encode()).hexdigest())
+        compiled = self.entries.get(key)
+        if compiled is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return compiled
+        self.misses += 1
+        compiled = self.entries[key] = CompiledTemplate(source)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return compiled
+
+
+template_cache = TemplateCache(TEMPLATE_CACHE_MAX)
+
+
+def validate_templates(agent_id: str, templates: List[dict]):
+    problems = []
+    for tpl in templates:
+        compiled = template_cache.get(agent_id, tpl["name"], tpl["template"])
+        declared = set(tpl.get("variables") or [])
+        undeclared = [v for v in compiled.variables if v not in declared]
+        unused = sorted(declared.difference(compiled.variables))
+        if undeclared or unused:
+            problems.append({"name": tpl["name"], "undeclared": undeclared, "unused": unused})
+    if problems:
+        raise HTTPException(status_code=422, detail={
+            "message": "Template variables do not match their placeholders",
+            "templates": problems,
+        })
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough budget figure: about four characters per token for English prose.
+    return (len(text) + 3) // 4
+
+
+def render_result(index: int, compiled: CompiledTemplate, values: Dict[str, Any], strict: bool) -> dict:
+    if strict:
+        missing = compiled.missing(values)
+        if missing:
+            return {"index": index, "error": f"Missing variables: {', '.join(missing)}"}
+    text = compiled.render(values)
+    return {"index": index, "text": text, "chars": len(text), "tokens": estimate_tokens(text)}
+
+
+# ── Live feed ──
+
+def public_event(doc: dict) -> dict:
+    return {
+        "id": str(doc["_id"]),
+        "type": doc["type"],
+        "agentId": doc["agentId"],
+        "action": doc["action"],
+        "target": doc.get("target", ""),
+        "targetId": doc.get("targetId"),
+        "detail": doc.get("detail"),
+        "createdAt": doc["createdAt"].isoformat(),
+    }
+
+
+def encode_feed_frame(doc: dict) -> str:
+    event = public_event(doc)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def encode_feed_reset(last_id: ObjectId) -> str:
+    data = json.dumps({"reason": "replay_limit", "limit": FEED_REPLAY_MAX})
+    return f"id: {last_id}\nevent: reset\ndata: {data}\n\n"
+
+
+def resolve_feed_types(tab: Optional[str], types: Optional[str]) -> Optional[Set[str]]:
+    if types:
+        wanted = {t.strip() for t in types.split(",") if t.strip()}
+        unknown = wanted.difference(FEED_TYPES)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown event types: {', '.join(sorted(unknown))}")
+        return wanted
+    if tab:
+        if tab not in FEED_TAB_TYPES:
+            raise HTTPException(status_code=400, detail=f"Unknown feed tab: {tab}")
+        tab_types = FEED_TAB_TYPES[tab]
+        return set(tab_types) if tab_types else None
+    return None
+
+
+def parse_event_id(value: str) -> ObjectId:
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid event id")
+
+
+class FeedSubscriber:
+    def __init__(self, types: Optional[Set[str]], max_queue: int):
+        self.types = types
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.evicted = False
+
+
+class FeedBroadcaster:
+    """Fans feed events out to every connected stream in this process.
+
+    Each subscriber has a bounded queue. A subscriber that falls behind is
+    evicted rather than allowed to grow without bound; its stream ends and
+    the client resumes from Last-Event-ID on reconnect.
+    """
+
+    def __init__(self, max_queue: int):
+        self.max_queue = max_queue
+        self.subscribers: Set[FeedSubscriber] = set()
+        self.published = 0
+        self.evictions = 0
+
+    def subscribe(self, types: Optional[Set[str]]) -> FeedSubscriber:
+        sub = FeedSubscriber(types, self.max_queue)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: FeedSubscriber):
+        self.subscribers.discard(sub)
+
+    def publish(self, doc: dict):
+        self.published += 1
+        item = None
+        for sub in list(self.subscribers):
+            if sub.types is not None and doc["type"] not in sub.types:
+                continue
+            if item is None:
+                item = (str(doc["_id"]), encode_feed_frame(doc))
+            try:
+                sub.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                sub.evicted = True
+                self.subscribers.discard(sub)
+                self.evictions += 1
+
+    async def watch(self):
+        pipeline = [{"$match": {"operationType": "insert", "fullDocument.origin": {"$ne": PROCESS_ID}}}]
+        while True:
+            try:
+                async with db.events.watch(pipeline) as stream:
+                    async for change in stream:
+                        self.publish(change["fullDocument"])
+                        search_index.add_event(change["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                logger.warning("Feed change stream unavailable, streaming local events only: %s", e)
+                return
+            except PyMongoError:
+                logger.exception("Feed change stream interrupted, reconnecting")
+                await asyncio.sleep(5)
+
+
+feed_broadcaster = FeedBroadcaster(FEED_SUBSCRIBER_QUEUE)
+
+
+def make_event(type: str, agent_id: str, action: str, target: str = "",
+               target_id: Optional[str] = None, detail: Optional[str] = None) -> dict:
+    return {
+        "_id": ObjectId(),
+        "type": type,
+        "agentId": agent_id,
+        "action": action,
+        "target": target,
+        "targetId": target_id,
+        "detail": detail,
+        "createdAt": datetime.now(timezone.utc),
+        "origin": PROCESS_ID,
+    }
+
+
+async def record_events(docs: List[dict]) -> bool:
+    if not docs:
+        return True
+    try:
+        await db.events.insert_many(docs, ordered=False)
+    except PyMongoError:
+        # The mutation that triggered the events has already been applied.
+        logger.exception("Failed to record %d feed events", len(docs))
+        return False
+    for doc in docs:
+        feed_broadcaster.publish(doc)
+        search_index.add_event(doc)
+    await standup_digest.add_decisions(docs)
+    activity_rollup.record(docs)
+    return True
+
+
+async def emit_event(type: str, agent_id: str, action: str, target: str = "",
+                     target_id: Optional[str] = None, detail: Optional[str] = None) -> Optional[dict]:
+    doc = make_event(type, agent_id, action, target, target_id, detail)
+    return doc if await record_events([doc]) else None
+
+
+# ── Tasks ──
+
+RANK_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+
+# A rank is an integer part followed by an optional fraction, as in
+# "generateKeyBetween" fractional indexing. The head character encodes the
+# integer part's length ("a" is 2 characters, "b" 3, ...; "Z" 2, "Y" 3, ...
+# below zero), so appending only increments the integer and ranks grow with
+# the log of the column size instead of one digit per few inserts.
+RANK_SMALLEST_INTEGER = "A" + RANK_DIGITS[0] * 26
+
+
+def rank_integer_length(head: str) -> int:
+    if "a" <= head <= "z":
+        return ord(head) - ord("a") + 2
+    if "A" <= head <= "Z":
+        return ord("Z") - ord(head) + 2
+    raise ValueError(f"Invalid rank head {head!r}")
+
+
+def split_rank(rank: str) -> Tuple[str, str]:
+    if not rank or any(c not in RANK_DIGITS for c in rank):
+        raise ValueError(f"Invalid rank {rank!r}")
+    n = rank_integer_length(rank[0])
+    if n > len(rank) or rank == RANK_SMALLEST_INTEGER or rank[n:].endswith(RANK_DIGITS[0]):
+        raise ValueError(f"Invalid rank {rank!r}")
+    return rank[:n], rank[n:]
+
+
+def is_valid_rank(rank: Any) -> bool:
+    try:
+        split_rank(rank)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def increment_rank_integer(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        d = RANK_DIGITS.index(digits[i]) + 1
+        if d < len(RANK_DIGITS):
+            digits[i] = RANK_DIGITS[d]
+            return head + "".join(digits)
+        digits[i] = RANK_DIGITS[0]
+    if head == "Z":
+        return "a" + RANK_DIGITS[0]
+    if head == "z":
+        return None
+    head = chr(ord(head) + 1)
+    if head > "a":
+        digits.append(RANK_DIGITS[0])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def decrement_rank_integer(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for i in range(len(digits) - 1, -1, -1):
+        d = RANK_DIGITS.index(digits[i]) - 1
+        if d >= 0:
+            digits[i] = RANK_DIGITS[d]
+            return head + "".join(digits)
+        digits[i] = RANK_DIGITS[-1]
+    if head == "a":
+        return "Z" + RANK_DIGITS[-1]
+    if head == "A":
+        return None
+    head = chr(ord(head) - 1)
+    if head < "Z":
+        digits.append(RANK_DIGITS[-1])
+    else:
+        digits.pop()
+    return head + "".join(digits)
+
+
+def rank_midpoint(lo: str, hi: Optional[str]) -> str:
+    """Fraction digits strictly between ``lo`` and ``hi`` (None for an open end)."""
+    zero = RANK_DIGITS[0]
+    prefix = ""
+    while True:
+        if hi is not None:
+            n = 0
+            while n < len(hi) and (lo[n] if n < len(lo) else zero) == hi[n]:
+                n += 1
+            prefix, lo, hi = prefix + hi[:n], lo[n:], hi[n:]
+        digit_lo = RANK_DIGITS.index(lo[0]) if lo else 0
+        digit_hi = RANK_DIGITS.index(hi[0]) if hi is not None else len(RANK_DIGITS)
+        if digit_hi - digit_lo > 1:
+            return prefix + RANK_DIGITS[(digit_lo + digit_hi + 1) // 2]
+        if hi is not None and len(hi) > 1:
+            return prefix + hi[0]
+        prefix, lo, hi = prefix + RANK_DIGITS[digit_lo], lo[1:], None
+
+
+def rank_between(lo: Optional[str], hi: Optional[str]) -> str:
+    """Return a rank string that sorts strictly between ``lo`` and ``hi``.
+
+    Either bound may be None for an open end. Moving a card rewrites only
+    that card, and appending or prepending steps the integer part.
+    """
+    if lo is not None and hi is not None and lo >= hi:
+        raise ValueError("Neighbour ranks are out of order")
+    if lo is None and hi is None:
+        return "a" + RANK_DIGITS[0]
+    if lo is None:
+        integer, fraction = split_rank(hi)
+        if integer == RANK_SMALLEST_INTEGER:
+            return integer + rank_midpoint("", fraction)
+        if fraction:
+            return integer
+        rank = decrement_rank_integer(integer)
+        if rank is None:
+            raise ValueError("Rank space exhausted")
+        return rank
+    integer, fraction = split_rank(lo)
+    if hi is None:
+        rank = increment_rank_integer(integer)
+        return rank if rank is not None else integer + rank_midpoint(fraction, None)
+    hi_integer, hi_fraction = split_rank(hi)
+    if integer == hi_integer:
+        return integer + rank_midpoint(fraction, hi_fraction)
+    rank = increment_rank_integer(integer)
+    if rank is not None and rank < hi:
+        return rank
+    return integer + rank_midpoint(fraction, None)
+
+
+async def column_tail_rank(column: str) -> Optional[str]:
+    last = await db.tasks.find({"column": column}, {"_id": 0, "rank": 1}).sort([("rank", -1), ("id", -1)]).limit(1).to_list(1)
+    return last[0]["rank"] if last else None
+
+
+async def plan_task_moves(moves: List[TaskMove]):
+    """Resolve neighbour ids to ranks for a batch of moves.
+
+    Moves are applied in order against an in-memory view, so a move may
+    reference a card moved earlier in the same batch.
+    """
+    ids = set()
+    for m in moves:
+        ids.update(i for i in (m.id, m.afterId, m.beforeId) if i)
+    docs = await db.tasks.find(
+        {"id": {"$in": list(ids)}}, {"_id": 0, "id": 1, "column": 1, "rank": 1, "title": 1, "assigneeId": 1,
+                                     "description": 1, "tags": 1, "createdAt": 1}
+    ).to_list(None)
+    view = {d["id"]: d for d in docs}
+    tails: Dict[str, Optional[str]] = {}
+    planned, errors = [], []
+
+    def neighbour(task_id: Optional[str], column: str) -> Optional[str]:
+        if task_id is None:
+            return None
+        doc = view.get(task_id)
+        if doc is None or doc["column"] != column:
+            raise ValueError(f"Neighbour {task_id} is not in column {column}")
+        return doc["rank"]
+
+    for m in moves:
+        task = view.get(m.id)
+        if task is None:
+            errors.append({"id": m.id, "detail": "Task not found"})
+            continue
+        try:
+            lo, hi = neighbour(m.afterId, m.column), neighbour(m.beforeId, m.column)
+            if m.afterId is None and m.beforeId is None:
+                if m.column not in tails:
+                    tails[m.column] = await column_tail_rank(m.column)
+                lo = tails[m.column]
+            rank = rank_between(lo, hi)
+        except ValueError as e:
+            errors.append({"id": m.id, "detail": str(e)})
+            continue
+        if m.column in tails and (tails[m.column] is None or rank > tails[m.column]):
+            tails[m.column] = rank
+        planned.append((m, task["column"], rank, task))
+        view[m.id] = {**task, "column": m.column, "rank": rank}
+    return planned, errors
+
+
+def move_event(move: TaskMove, from_column: str, task: dict) -> Optional[dict]:
+    if from_column == move.column:
+        return None
+    transition = f"{KANBAN_COLUMNS[from_column]} → {KANBAN_COLUMNS[move.column]}"
+    return make_event("task_moved", move.actorId or task.get("assigneeId") or "", "moved",
+                      task["title"], task["id"], transition)
+
+
+# ── Standup digest ──
+
+STANDUP_SECTIONS = ("completed", "inProgress", "blocked", "needsReview", "keyDecisions")
+STANDUP_COLUMN_SECTIONS = {"in-progress": "inProgress", "review": "needsReview", "done": "completed"}
+BLOCKED_TAG = "blocked"
+# Sections that describe what happened rather than where things stand.
+STANDUP_WINDOWED_SECTIONS = ("completed", "keyDecisions")
+
+
+def standup_section(task: dict) -> Optional[str]:
+    if task["column"] != "done" and BLOCKED_TAG in (task.get("tags") or ()):
+        return "blocked"
+    return STANDUP_COLUMN_SECTIONS.get(task["column"])
+
+
+def standup_entry(task: dict, section: str) -> dict:
+    return {
+        "section": section,
+        "title": task["title"],
+        "agentId": task.get("assigneeId"),
+        "detail": task.get("description") or "",
+        "at": task.get("movedAt") or task.get("createdAt"),
+    }
+
+
+class StandupDigest:
+    """Materialized standup document kept current by each task and decision write.
+
+    Task entries live under ``items.<taskId>`` so a mutation is a single
+    ``$set``/``$unset`` on one document; decisions are a capped array.
+    Reads are one ``find_one`` regardless of how many tasks exist.
+    """
+
+    doc_id = "current"
+
+    def __init__(self, decisions_max: int):
+        self.decisions_max = decisions_max
+
+    async def _update(self, ops: dict):
+        try:
+            await db.standup.update_one({"_id": self.doc_id}, ops, upsert=True)
+        except PyMongoError:
+            # The task write has been applied; POST /api/standup/rebuild recovers.
+            logger.exception("Failed to update standup digest")
+
+    async def apply_tasks(self, tasks: List[dict] = (), removed: List[str] = ()):
+        sets, unsets = {}, {}
+        for task in tasks:
+            section = standup_section(task)
+            if section:
+                sets[f"items.{task['id']}"] = standup_entry(task, section)
+            else:
+                unsets[f"items.{task['id']}"] = ""
+        for task_id in removed:
+            unsets[f"items.{task_id}"] = ""
+        ops = {}
+        if sets:
+            ops["$set"] = sets
+        if unsets:
+            ops["$unset"] = unsets
+        if ops:
+            await self._update(ops)
+
+    async def add_decisions(self, events: List[dict]):
+        entries = [
+            {"id": str(e["_id"]), "title": e["target"] or e["action"], "agentId": e["agentId"],
+             "detail": e.get("detail") or "", "at": e["createdAt"]}
+            for e in events if e["type"] == "decision"
+        ]
+        if entries:
+            await self._update({"$push": {"decisions": {"$each": entries, "$slice": -self.decisions_max}}})
+
+    async def rebuild(self) -> dict:
+        current = await db.standup.find_one({"_id": self.doc_id}, {"lastStandupAt": 1, "previousStandupAt": 1}) or {}
+        retain_since = current.get("previousStandupAt")
+        done = {"column": "done"}
+        if retain_since:
+            done["movedAt"] = {"$gte": retain_since}
+        tasks = await db.tasks.find(
+            {"$or": [{"column": {"$in": ["in-progress", "review"]}}, {"tags": BLOCKED_TAG}, done]},
+            {"_id": 0, "id": 1, "title": 1, "assigneeId": 1, "description": 1, "tags": 1, "column": 1,
+             "movedAt": 1, "createdAt": 1},
+        ).to_list(None)
+        decision_query = {"type": "decision"}
+        if retain_since:
+            decision_query["createdAt"] = {"$gte": retain_since}
+        events = await db.events.find(decision_query).sort("_id", -1).limit(self.decisions_max).to_list(None)
+        doc = {
+            "items": {t["id"]: standup_entry(t, standup_section(t)) for t in tasks if standup_section(t)},
+            "decisions": [],
+            "lastStandupAt": current.get("lastStandupAt"),
+            "previousStandupAt": retain_since,
+            "rebuiltAt": datetime.now(timezone.utc),
+        }
+        await db.standup.replace_one({"_id": self.doc_id}, doc, upsert=True)
+        await self.add_decisions(events[::-1])
+        return {"items": len(doc["items"]), "decisions": min(len(events), self.decisions_max)}
+
+    async def close(self) -> datetime:
+        """Mark a standup as held and drop history older than the previous one."""
+        now = datetime.now(timezone.utc)
+        current = await db.standup.find_one({"_id": self.doc_id}) or {}
+        cutoff = current.get("lastStandupAt")
+        ops = {"$set": {"lastStandupAt": now, "previousStandupAt": cutoff}}
+        if cutoff:
+            stale = {
+                f"items.{task_id}": "" for task_id, item in (current.get("items") or {}).items()
+                if item["section"] == "completed" and item["at"] < cutoff
+            }
+            if stale:
+                ops["$unset"] = stale
+            ops["$pull"] = {"decisions": {"at": {"$lt": cutoff}}}
+        await db.standup.update_one({"_id": self.doc_id}, ops, upsert=True)
+        return now
+
+    async def read(self, since: Optional[datetime]) -> dict:
+        doc = await db.standup.find_one({"_id": self.doc_id})
+        if doc is None:
+            await self.rebuild()
+            doc = await db.standup.find_one({"_id": self.doc_id}) or {}
+        snap = await agent_cache.snapshot()
+
+        def shape(item_id: str, item: dict) -> dict:
+            agent = snap.agents.get(item["agentId"]) if item["agentId"] else None
+            return {"id": item_id, "title": item["title"], "agent": agent.name if agent else item["agentId"],
+                    "agentId": item["agentId"], "detail": item["detail"], "at": item["at"]}
+
+        digest = {section: [] for section in STANDUP_SECTIONS}
+        for task_id, item in (doc.get("items") or {}).items():
+            digest[item["section"]].append(shape(task_id, item))
+        digest["keyDecisions"] = [shape(d["id"], d) for d in doc.get("decisions") or ()]
+        for section, items in digest.items():
+            if since and section in STANDUP_WINDOWED_SECTIONS:
+                items[:] = [i for i in items if i["at"] >= since]
+            items.sort(key=lambda i: i["at"], reverse=True)
+        return {**digest, "lastStandupAt": doc.get("lastStandupAt"), "since": since}
+
+
+standup_digest = StandupDigest(STANDUP_DECISIONS_MAX)
+
+
+# ── Activity rollups ──
+
+ROLLUP_UNITS = {"minute": 60, "hour": 3600, "day": 86400}
+# range -> (span in seconds, bucket unit served)
+ACTIVITY_RANGES = {
+    "1h": (3600, "minute"),
+    "24h": (86400, "hour"),
+    "7d": (7 * 86400, "hour"),
+    "30d": (30 * 86400, "day"),
+}
+ROLLUP_FOLD_MARKS = 32
+
+
+def bucket_start(ts: datetime, unit: str) -> datetime:
+    step = ROLLUP_UNITS[unit]
+    return datetime.fromtimestamp(int(ts.timestamp()) // step * step, timezone.utc)
+
+
+async def bulk_write_folds(collection, ops: List[UpdateOne]):
+    """Apply fold upserts whose filters exclude targets already carrying the fold token."""
+    if not ops:
+        return
+    try:
+        await collection.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # A duplicate key means the target already carries this token.
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+
+class ActivityRollup:
+    """Per-agent, per-event-type counters in pre-aggregated bucket documents.
+
+    Recorded events are counted in memory and a background flusher ``$inc``s
+    the minute buckets once per ``flush_interval``, so recording costs no
+    round trip on the request path. The compactor folds
+    minute buckets into hour buckets, and hour buckets into day buckets, once
+    they are older than the finer unit's retention. Each fold is tagged with
+    a token recorded on the target bucket, so a fold interrupted between the
+    ``$inc`` and the delete can be resumed without counting twice.
+    """
+
+    def __init__(self, minute_retention_hours: float, hour_retention_days: float, interval: float,
+                 flush_interval: float):
+        self.minute_retention = minute_retention_hours * 3600
+        self.hour_retention = hour_retention_days * 86400
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.pending: Dict[Tuple[str, datetime], collections.Counter] = collections.defaultdict(collections.Counter)
+        self.flushes = 0
+        self._stopping = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def record(self, events: List[dict]):
+        for e in events:
+            if e["agentId"]:
+                self.pending[(e["agentId"], bucket_start(e["createdAt"], "minute"))][e["type"]] += 1
+
+    def start(self):
+        self._stopping.clear()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        # The flusher is never cancelled mid-write; it sees the event, flushes once more and exits.
+        if self._flusher is not None:
+            self._stopping.set()
+            await self._flusher
+            self._flusher = None
+
+    async def _flush_loop(self):
+        stopping = False
+        while not stopping:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+                stopping = True
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> int:
+        if not self.pending:
+            return 0
+        pending, self.pending = self.pending, collections.defaultdict(collections.Counter)
+        keys = list(pending)
+        ops = [
+            UpdateOne(
+                {"unit": "minute", "start": start, "agentId": agent_id},
+                {"$inc": {"total": sum(counts.values()), **{f"counts.{t}": n for t, n in counts.items()}}},
+                upsert=True,
+            )
+            for (agent_id, start), counts in pending.items()
+        ]
+        failed: List[Tuple[str, datetime]] = []
+        try:
+            await db.activity.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            failed = [keys[err["index"]] for err in e.details.get("writeErrors", [])]
+        except PyMongoError:
+            # Nothing says which upserts landed; retrying them all may overcount
+            # rather than silently dropping the counts.
+            logger.exception("Activity rollup flush failed, retrying %d buckets", len(keys))
+            failed = keys
+        for key in failed:
+            self.pending[key].update(pending[key])
+        self.flushes += 1
+        return len(keys) - len(failed)
+
+    async def _fold_marked(self, unit: str, into: str, token: str) -> int:
+        docs = await db.activity.find({"unit": unit, "compacting": token}).to_list(None)
+        folded: Dict[Tuple[str, datetime], collections.Counter] = collections.defaultdict(collections.Counter)
+        for doc in docs:
+            folded[(doc["agentId"], bucket_start(doc["start"], into))].update(doc.get("counts") or {})
+        ops = [
+            UpdateOne(
+                {"unit": into, "start": start, "agentId": agent_id, "folds": {"$ne": token}},
+                {
+                    "$inc": {"total": sum(counts.values()), **{f"counts.{t}": n for t, n in counts.items()}},
+                    "$push": {"folds": {"$each": [token], "$slice": -ROLLUP_FOLD_MARKS}},
+                },
+                upsert=True,
+            )
+            for (agent_id, start), counts in folded.items()
+        ]
+        await bulk_write_folds(db.activity, ops)
+        await db.activity.delete_many({"unit": unit, "compacting": token})
+        return len(docs)
+
+    async def fold(self, unit: str, into: str, cutoff: datetime) -> int:
+        folded = 0
+        for token in await db.activity.distinct("compacting", {"unit": unit}):
+            folded += await self._fold_marked(unit, into, token)
+        token = uuid.uuid4().hex
+        await db.activity.update_many(
+            {"unit": unit, "start": {"$lt": cutoff}, "compacting": {"$exists": False}},
+            {"$set": {"compacting": token}},
+        )
+        return folded + await self._fold_marked(unit, into, token)
+
+    async def compact(self) -> Dict[str, int]:
+        now = datetime.now(timezone.utc).timestamp()
+        minute_cutoff = bucket_start(datetime.fromtimestamp(now - self.minute_retention, timezone.utc), "hour")
+        hour_cutoff = bucket_start(datetime.fromtimestamp(now - self.hour_retention, timezone.utc), "day")
+        return {
+            "minute": await self.fold("minute", "hour", minute_cutoff),
+            "hour": await self.fold("hour", "day", hour_cutoff),
+        }
+
+    async def run(self):
+        while True:
+            try:
+                result = await self.compact()
+                if any(result.values()):
+                    logger.info("Compacted activity buckets: %s", result)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Activity rollup compaction failed")
+            await asyncio.sleep(self.interval)
+
+    async def read(self, range_key: str) -> dict:
+        span, unit = ACTIVITY_RANGES[range_key]
+        step = ROLLUP_UNITS[unit]
+        end = bucket_start(datetime.now(timezone.utc), unit).timestamp() + step
+        start = datetime.fromtimestamp(end - span, timezone.utc)
+        # Buckets not yet folded into ``unit`` still count toward it.
+        units = [u for u, seconds in ROLLUP_UNITS.items() if seconds <= step]
+        docs = await db.activity.find(
+            {"unit": {"$in": units}, "start": {"$gte": start, "$lt": datetime.fromtimestamp(end, timezone.utc)}},
+            {"_id": 0, "agentId": 1, "start": 1, "counts": 1, "total": 1},
+        ).to_list(None)
+        n = span // step
+        snap = await agent_cache.snapshot()
+        rows = {agent_id: {"agentId": agent_id, "total": 0, "counts": collections.Counter(), "series": [0] * n}
+                for agent_id in snap.agents}
+        for doc in docs:
+            row = rows.setdefault(doc["agentId"], {"agentId": doc["agentId"], "total": 0,
+                                                   "counts": collections.Counter(), "series": [0] * n})
+            row["series"][int((doc["start"] - start).total_seconds()) // step] += doc.get("total", 0)
+            row["total"] += doc.get("total", 0)
+            row["counts"].update(doc.get("counts") or {})
+        return {
+            "range": range_key,
+            "unit": unit,
+            "start": start,
+            "bucketSeconds": step,
+            "buckets": n,
+            "agents": [{**row, "counts": dict(row["counts"])} for row in rows.values()],
+        }
+
+
+activity_rollup = ActivityRollup(ROLLUP_MINUTE_RETENTION_HOURS, ROLLUP_HOUR_RETENTION_DAYS,
+                                 ROLLUP_COMPACT_INTERVAL_SECONDS, ROLLUP_FLUSH_INTERVAL_SECONDS)
+
+
+# ── Search ──
+
+SEARCH_KINDS = ("agents", "tasks", "events")
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """In-process inverted index over agents, tasks and feed events.
+
+    Postings map each term to the documents containing it, weighted by the
+    fields it appears in. ``terms`` is kept sorted so prefix queries are a
+    bisect plus a scan capped at SEARCH_PREFIX_BUDGET postings; an exact
+    term sorts first, so it always counts. Writes update single documents in place;
+    only recovery after a lost change stream rebuilds from Mongo.
+    """
+
+    def __init__(self, max_events: int):
+        self.max_events = max_events
+        # Documents are keyed by small ints with the kind in the low two bits,
+        # which keeps the hot loops in search() on cheap int hashing.
+        self.next_key = 0
+        self.keys: Dict[Tuple[str, str], int] = {}
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.terms: List[str] = []
+        self.doc_terms: Dict[int, Dict[str, float]] = {}
+        self.docs: Dict[int, dict] = {}
+        self.events: collections.deque = collections.deque()
+        self.task_oids: Dict[ObjectId, str] = {}
+        self.loaded = asyncio.Event()
+
+    def put(self, kind: str, doc_id: str, fields: List[Tuple[str, float]], payload: dict):
+        self.remove(kind, doc_id)
+        key = (self.next_key << 2) | SEARCH_KINDS.index(kind)
+        self.next_key += 1
+        weights: Dict[str, float] = {}
+        for text, weight in fields:
+            for term in set(tokenize(text or "")):
+                weights[term] = weights.get(term, 0.0) + weight
+        for term, weight in weights.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[key] = weight
+        self.keys[(kind, doc_id)] = key
+        self.doc_terms[key] = weights
+        self.docs[key] = payload
+
+    def remove(self, kind: str, doc_id: str):
+        key = self.keys.pop((kind, doc_id), None)
+        if key is None:
+            return
+        del self.docs[key]
+        for term in self.doc_terms.pop(key):
+            posting = self.postings[term]
+            del posting[key]
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def touch(self, kind: str, doc_id: str, **fields):
+        key = self.keys.get((kind, doc_id))
+        if key is not None:
+            self.docs[key].update(fields)
+
+    def add_agent(self, doc: dict):
+        fields = [(doc.get("name", ""), 3.0), (doc.get("role", ""), 2.0), (doc.get("systemInstructions", ""), 1.0)]
+        for tpl in doc.get("promptTemplates") or []:
+            fields += [(tpl.get("name", ""), 1.5), (tpl.get("template", ""), 0.5)]
+        payload = {k: doc.get(k) for k in ("id", "name", "role", "badge", "status")}
+        self.put("agents", doc["id"], fields, payload)
+
+    def add_task(self, doc: dict):
+        fields = [(doc.get("title", ""), 3.0), (" ".join(doc.get("tags") or []), 2.0), (doc.get("description", ""), 1.0)]
+        payload = {k: doc.get(k) for k in ("id", "title", "column", "assigneeId", "priority")}
+        self.put("tasks", doc["id"], fields, payload)
+        if "_id" in doc:
+            self.task_oids[doc["_id"]] = doc["id"]
+
+    def remove_task(self, task_id: str):
+        self.remove("tasks", task_id)
+
+    def add_event(self, doc: dict):
+        event = public_event(doc)
+        if ("events", event["id"]) in self.keys:
+            return
+        fields = [(event["target"], 2.0), (event["action"], 1.0), (event["detail"] or "", 1.0)]
+        self.put("events", event["id"], fields, event)
+        self.events.append(event["id"])
+        while len(self.events) > self.max_events:
+            self.remove("events", self.events.popleft())
+
+    def search(self, query: str, kinds, limit: int) -> Dict[str, List[dict]]:
+        kind_mask = 0
+        for kind in kinds:
+            kind_mask |= 1 << SEARCH_KINDS.index(kind)
+        scores: Optional[Dict[int, float]] = None
+        for token in tokenize(query):
+            matches: Dict[int, float] = {}
+            budget = SEARCH_PREFIX_BUDGET
+            i = bisect.bisect_left(self.terms, token)
+            while budget > 0 and i < len(self.terms) and self.terms[i].startswith(token):
+                term = self.terms[i]
+                posting = self.postings[term]
+                boost = 1.0 if term == token else 0.6
+                for key, weight in posting.items():
+                    if (1 << (key & 3)) & kind_mask and weight * boost > matches.get(key, 0.0):
+                        matches[key] = weight * boost
+                budget -= len(posting)
+                i += 1
+            # Every query token must match (AND); the last one is usually a partial word.
+            if scores is None:
+                scores = matches
+            else:
+                small, large = sorted((scores, matches), key=len)
+                scores = {k: v + large[k] for k, v in small.items() if k in large}
+            if not scores:
+                break
+        groups: Dict[str, List[Tuple[float, int]]] = {kind: [] for kind in kinds}
+        for key, score in (scores or {}).items():
+            groups[SEARCH_KINDS[key & 3]].append((score, key))
+        return {
+            kind: [
+                {**self.docs[key], "score": round(score, 3)}
+                for score, key in heapq.nlargest(limit, items)
+            ]
+            for kind, items in groups.items()
+        }
+
+    async def rebuild(self):
+        fresh = SearchIndex(self.max_events)
+        async for doc in db.agents.find({}, {"_id": 0}):
+            fresh.add_agent(doc)
+        async for doc in db.tasks.find({}, {"title": 1, "tags": 1, "description": 1, "id": 1, "column": 1, "assigneeId": 1, "priority": 1}):
+            fresh.add_task(doc)
+        recent = await db.events.find({}).sort("_id", -1).limit(self.max_events).to_list(self.max_events)
+        for doc in reversed(recent):
+            fresh.add_event(doc)
+        for attr in ("next_key", "keys", "postings", "terms", "doc_terms", "docs", "events", "task_oids"):
+            setattr(self, attr, getattr(fresh, attr))
+        self.loaded.set()
+        logger.info("Search index built: %d documents, %d terms", len(self.docs), len(self.terms))
+
+    def apply_change(self, change: dict):
+        coll = change["ns"]["coll"]
+        if change["operationType"] == "delete":
+            if coll == "tasks":
+                task_id = self.task_oids.pop(change["documentKey"]["_id"], None)
+                if task_id:
+                    self.remove_task(task_id)
+            return
+        doc = change.get("fullDocument")
+        if doc is None:
+            return
+        if coll == "agents":
+            self.add_agent(doc)
+        elif coll == "tasks":
+            self.add_task(doc)
+        elif coll == "events":
+            self.add_event(doc)
+
+    async def watch(self):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": ["agents", "tasks", "events"]},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+        while True:
+            try:
+                # Open the stream before loading so nothing written during the load is missed.
+                async with db.watch(pipeline, full_document="updateLookup") as stream:
+                    await self.rebuild()
+                    async for change in stream:
+                        self.apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                logger.warning("Search change stream unavailable, indexing local writes only: %s", e)
+                await self.rebuild()
+                return
+            except PyMongoError:
+                logger.exception("Search change stream interrupted, rebuilding")
+                await asyncio.sleep(5)
+
+
+search_index = SearchIndex(SEARCH_MAX_EVENTS)
+
+
+# ── LLM jobs ──
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+
+
+def parse_limits(spec: str) -> Dict[str, float]:
+    """Parse ``key=value,...`` where a key is a provider, ``provider/model``, a route class or ``*``."""
+    limits = {}
+    for part in spec.split(","):
+        if part.strip():
+            key, _, value = part.partition("=")
+            limits[key.strip()] = float(value)
+    return limits
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float = 1.0) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float = 1.0) -> bool:
+        if self.wait_time(amount):
+            return False
+        self.tokens -= amount
+        return True
+
+
+class ProviderError(Exception):
+    def __init__(self, message: str, retryable: bool = True, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class LLMProvider(ABC):
+    """Adapter interface: run one job's prompt and return its completion.
+
+    ``complete`` returns ``{"text", "inputTokens", "outputTokens"}`` and raises
+    ProviderError for failures; ``retryable=False`` fails the job immediately.
+    """
+
+    @abstractmethod
+    async def complete(self, job: dict) -> dict:
+        ...
+
+    async def aclose(self):
+        pass
+
+
+class StubProvider(LLMProvider):
+    """Offline provider whose output depends only on the request.
+
+    Injected failures are decided by hashing the prompt with the attempt
+    number, so a given job fails and recovers the same way on every run.
+    """
+
+    def __init__(self, latency: float, failure_rate: float):
+        self.latency = latency
+        self.failure_rate = failure_rate
+
+    async def complete(self, job: dict) -> dict:
+        digest = hashlib.sha256(f"{job['model']}\0{job['system']}\0{job['prompt']}".encode()).hexdigest()
+        await asyncio.sleep(self.latency)
+        roll = int(hashlib.sha256(f"{digest}:{job['attempts']}".encode()).hexdigest()[:8], 16) / 0x100000000
+        if roll < self.failure_rate:
+            raise ProviderError("stub: injected failure")
+        text = f"[{job['model'] or 'stub'}:{digest[:12]}] " + " ".join(job["prompt"].split()[:32])
+        return {"text": text, "inputTokens": estimate_tokens(job["system"] + job["prompt"]),
+                "outputTokens": estimate_tokens(text)}
+
+
+# Agents store display labels; provider APIs want model ids. Labels not listed
+# here are sent as-is, so an agent may also store the API id directly.
+MODEL_API_IDS = {
+    "Claude Sonnet 4.5": "claude-sonnet-4-5",
+    "Claude Haiku 4.5": "claude-haiku-4-5",
+    "GPT-4o": "gpt-4o",
+    "GPT-4o Mini": "gpt-4o-mini",
+    "Kimi K2.5": "kimi-k2.5",
+}
+for part in LLM_MODEL_IDS.split(","):
+    if part.strip():
+        label, _, model_id = part.partition("=")
+        MODEL_API_IDS[label.strip()] = model_id.strip()
+
+
+def model_api_id(model: str) -> str:
+    return MODEL_API_IDS.get(model, model)
+
+
+class HTTPProvider(LLMProvider):
+    def __init__(self, base_url: str, api_key: str, timeout: float):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def post(self, path: str, headers: dict, body: dict) -> dict:
+        if self.client is None:
+            self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+        try:
+            response = await self.client.post(path, headers=headers, json=body)
+        except httpx.TransportError as e:
+            raise ProviderError(f"{type(e).__name__}: {e}")
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = response.headers.get("retry-after")
+            raise ProviderError(f"HTTP {response.status_code}",
+                                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        if response.status_code >= 400:
+            raise ProviderError(f"HTTP {response.status_code}: {response.text[:200]}", retryable=False)
+        return response.json()
+
+    async def aclose(self):
+        if self.client is not None:
+            client, self.client = self.client, None
+            await client.aclose()
+
+
+class AnthropicProvider(HTTPProvider):
+    async def complete(self, job: dict) -> dict:
+        data = await self.post("/v1/messages", {"x-api-key": self.api_key, "anthropic-version": "2023-06-01"}, {
+            "model": model_api_id(job["model"]),
+            "max_tokens": 1024,
+            "system": job["system"],
+            "messages": [{"role": "user", "content": job["prompt"]}],
+        })
+        text = "".join(block.get("text", "") for block in data.get("content", []))
+        usage = data.get("usage", {})
+        return {"text": text, "inputTokens": usage.get("input_tokens"), "outputTokens": usage.get("output_tokens")}
+
+
+class OpenAIProvider(HTTPProvider):
+    """Chat Completions API; also serves OpenAI-compatible providers such as Moonshot."""
+
+    async def complete(self, job: dict) -> dict:
+        messages = [{"role": "user", "content": job["prompt"]}]
+        if job["system"]:
+            messages.insert(0, {"role": "system", "content": job["system"]})
+        data = await self.post("/chat/completions", {"Authorization": f"Bearer {self.api_key}"},
+                               {"model": model_api_id(job["model"]), "messages": messages})
+        usage = data.get("usage", {})
+        return {"text": data["choices"][0]["message"]["content"],
+                "inputTokens": usage.get("prompt_tokens"), "outputTokens": usage.get("completion_tokens")}
+
+
+llm_providers: Dict[str, LLMProvider] = {"stub": StubProvider(LLM_STUB_LATENCY_MS / 1000, LLM_STUB_FAILURE_RATE)}
+
+
+def register_provider(name: str, provider: LLMProvider):
+    llm_providers[name.lower()] = provider
+
+
+if ANTHROPIC_API_KEY:
+    register_provider("anthropic", AnthropicProvider("https://api.anthropic.com", ANTHROPIC_API_KEY, LLM_TIMEOUT_SECONDS))
+if OPENAI_API_KEY:
+    register_provider("openai", OpenAIProvider("https://api.openai.com/v1", OPENAI_API_KEY, LLM_TIMEOUT_SECONDS))
+if MOONSHOT_API_KEY:
+    register_provider("moonshot", OpenAIProvider("https://api.moonshot.cn/v1", MOONSHOT_API_KEY, LLM_TIMEOUT_SECONDS))
+
+
+def resolve_provider(name: str) -> Optional[LLMProvider]:
+    provider = llm_providers.get(name.lower())
+    if provider is None and LLM_FALLBACK_PROVIDER:
+        provider = llm_providers.get(LLM_FALLBACK_PROVIDER.lower())
+    return provider
+
+
+def job_key(provider: str, model: str, system: str, prompt: str) -> str:
+    return hashlib.sha256("\0".join((provider, model, system, prompt)).encode()).hexdigest()
+
+
+def public_job(doc: dict) -> dict:
+    hidden = ("_id", "activeKey", "leaseToken", "system")
+    return {k: v for k, v in doc.items() if k not in hidden}
+
+
+class JobRunner:
+    """Leases jobs from the ``jobs`` collection and runs them on a worker pool.
+
+    A claim sets a lease that a heartbeat keeps extending; if the worker
+    dies the lease lapses and any process may reclaim the job. Concurrency
+    and rate limits are enforced per process and keyed by provider and by
+    ``provider/model``: claims are serialized within the process so the
+    limits checked before a claim still hold when it lands, and the claim
+    query skips jobs for saturated keys rather than taking and parking them.
+    """
+
+    poll_interval = LLM_POLL_INTERVAL_MS / 1000
+
+    def __init__(self, workers: int, concurrency: Dict[str, float], rates: Dict[str, float],
+                 lease: float, timeout: float):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.rates = rates
+        self.lease = lease
+        self.timeout = timeout
+        self.inflight: collections.Counter = collections.Counter()
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.claim_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.tasks: List[asyncio.Task] = []
+
+    def limit(self, key: str) -> Optional[float]:
+        if "/" in key:
+            return self.concurrency.get(key)
+        return self.concurrency.get(key, self.concurrency.get("*"))
+
+    def bucket(self, key: str) -> Optional[TokenBucket]:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            per_minute = self.rates.get(key, None if "/" in key else self.rates.get("*"))
+            if not per_minute:
+                return None
+            bucket = self.buckets[key] = TokenBucket(per_minute / 60, max(1.0, per_minute / 60))
+        return bucket
+
+    def saturated(self) -> Tuple[List[str], List[str], float]:
+        """Providers and models with no free slot or rate budget, and the soonest budget frees up."""
+        providers, models, wait = [], [], self.poll_interval
+        for key in set(self.inflight) | set(self.buckets):
+            limit = self.limit(key)
+            full = limit is not None and self.inflight[key] >= limit
+            bucket = self.bucket(key)
+            delay = bucket.wait_time() if bucket else 0.0
+            if full or delay:
+                (models if "/" in key else providers).append(key)
+                if delay and not full:
+                    wait = min(wait, delay)
+        return providers, models, wait
+
+    async def claim(self) -> Tuple[Optional[dict], float]:
+        async with self.claim_lock:
+            providers, models, wait = self.saturated()
+            now = datetime.now(timezone.utc)
+            query = {"$or": [
+                {"status": "queued", "runAt": {"$lte": now}},
+                {"status": "running", "leaseUntil": {"$lt": now}},
+            ]}
+            if providers:
+                query["provider"] = {"$nin": providers}
+            if models:
+                query["modelKey"] = {"$nin": models}
+            job = await db.jobs.find_one_and_update(
+                query,
+                {
+                    "$set": {"status": "running", "leaseToken": uuid.uuid4().hex, "startedAt": now, "updatedAt": now,
+                             "leaseUntil": datetime.fromtimestamp(now.timestamp() + self.lease, timezone.utc)},
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("runAt", 1)], projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+            )
+            if job is not None:
+                for key in (job["provider"], job["modelKey"]):
+                    self.inflight[key] += 1
+                    bucket = self.bucket(key)
+                    if bucket:
+                        bucket.take()
+            return job, wait
+
+    async def finish(self, job: dict, ops: dict) -> bool:
+        ops.setdefault("$set", {})["updatedAt"] = datetime.now(timezone.utc)
+        ops.setdefault("$unset", {}).update(leaseToken="", leaseUntil="")
+        # Guarded by the lease so a worker that lost its job cannot overwrite the new owner's result.
+        result = await db.jobs.update_one({"id": job["id"], "leaseToken": job["leaseToken"]}, ops)
+        return bool(result.modified_count)
+
+    async def heartbeat(self, job: dict):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            until = datetime.fromtimestamp(time.time() + self.lease, timezone.utc)
+            await db.jobs.update_one({"id": job["id"], "leaseToken": job["leaseToken"]}, {"$set": {"leaseUntil": until}})
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        delay = min(LLM_RETRY_MAX_MS, LLM_RETRY_BASE_MS * 2 ** (attempt - 1)) / 1000
+        delay *= random.uniform(0.5, 1.0)
+        return max(delay, retry_after or 0.0)
+
+    async def execute(self, job: dict):
+        labels = (job["provider"], job["model"])
+        provider = resolve_provider(job["provider"])
+        heartbeat = asyncio.create_task(self.heartbeat(job))
+        started = time.perf_counter()
+        now = lambda: datetime.now(timezone.utc)  # noqa: E731
+        try:
+            if provider is None:
+                raise ProviderError(f"No adapter for provider {job['provider']!r}", retryable=False)
+            if job["attempts"] > job["maxAttempts"]:
+                # Reclaimed after its lease lapsed on every allowed attempt.
+                raise ProviderError("Lease expired on every attempt", retryable=False)
+            result = await asyncio.wait_for(provider.complete(job), self.timeout)
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back without spending the attempt.
+            await self.finish(job, {"$set": {"status": "queued", "runAt": now()}, "$inc": {"attempts": -1}})
+            raise
+        except Exception as e:
+            retryable = isinstance(e, asyncio.TimeoutError) or getattr(e, "retryable", True)
+            error = str(e) or type(e).__name__
+            if retryable and job["attempts"] < job["maxAttempts"]:
+                run_at = datetime.fromtimestamp(time.time() + self.backoff(job["attempts"], getattr(e, "retry_after", None)), timezone.utc)
+                await self.finish(job, {"$set": {"status": "queued", "runAt": run_at, "error": error}})
+                outcome = "retried"
+            else:
+                await self.finish(job, {"$set": {"status": "failed", "error": error, "finishedAt": now()},
+                                        "$unset": {"activeKey": ""}})
+                outcome = "failed"
+            if not isinstance(e, (ProviderError, asyncio.TimeoutError)):
+                logger.exception("LLM job %s raised", job["id"])
+        else:
+            await self.finish(job, {"$set": {"status": "succeeded", "result": result, "error": None, "finishedAt": now()},
+                                    "$unset": {"activeKey": ""}})
+            outcome = "succeeded"
+        finally:
+            heartbeat.cancel()
+        llm_jobs.inc(labels + (outcome,))
+        llm_job_latency.observe(labels, time.perf_counter() - started)
+
+    async def worker(self):
+        # wait_for can swallow a cancel that lands as the wakeup fires, so shutdown is also signalled by flag.
+        while not self.stopping:
+            try:
+                job, wait = await self.claim()
+            except PyMongoError:
+                logger.exception("Failed to claim an LLM job")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                continue
+            try:
+                await self.execute(job)
+            except PyMongoError:
+                logger.exception("Failed to record the outcome of LLM job %s", job["id"])
+            finally:
+                for key in (job["provider"], job["modelKey"]):
+                    self.inflight[key] -= 1
+
+    def start(self):
+        self.stopping = False
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        self.stopping = True
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.tasks),
+            "inFlight": {k: v for k, v in self.inflight.items() if v},
+            "concurrency": self.concurrency,
+            "ratePerMinute": self.rates,
+            "providers": sorted(llm_providers),
+        }
+
+
+job_runner = JobRunner(LLM_WORKERS, parse_limits(LLM_CONCURRENCY), parse_limits(LLM_RATE_LIMITS),
+                       LLM_LEASE_SECONDS, LLM_TIMEOUT_SECONDS)
+
+
+# ── Admission control ──
+
+class AdmissionGate:
+    """In-flight cap for one route class with a FIFO wait queue.
+
+    A request that finds every slot taken waits at most the queue budget. When
+    the recent service time says the queue ahead of it will not drain within
+    the budget, it is rejected straight away instead of holding a connection.
+    """
+
+    def __init__(self, name: str, limit: int, budget: float):
+        self.name = name
+        self.limit = limit
+        self.budget = budget
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = collections.deque()
+        self.service_time = 0.0
+
+    def expected_wait(self) -> float:
+        return (len(self.waiters) + 1) * self.service_time / self.limit
+
+    async def acquire(self) -> Optional[Tuple[str, float]]:
+        """Take a slot, or return (reason, retry after) when the request should be shed."""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return None
+        expected = self.expected_wait()
+        if expected > self.budget:
+            return "queue", expected
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            # release() hands its slot straight to the waiter, so active is not bumped here.
+            await asyncio.wait_for(waiter, self.budget)
+        except asyncio.TimeoutError:
+            return "timeout", max(self.expected_wait(), self.budget)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter.cancelled() and waiter in self.waiters:
+                self.waiters.remove(waiter)
+        return None
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def observe(self, elapsed: float):
+        self.service_time = elapsed if not self.service_time else self.service_time + 0.1 * (elapsed - self.service_time)
+
+
+class AdmissionControl:
+    # Long-lived streams and probes must not hold or wait for a slot.
+    exempt_paths = ("/api/feed/stream", "/api/metrics", "/api/health/live", "/api/health/ready")
+
+    def __init__(self, concurrency: Dict[str, float], rates: Dict[str, float], budget: float):
+        self.gates = {name: AdmissionGate(name, int(limit), budget) for name, limit in concurrency.items() if limit > 0}
+        self.rates = rates
+        self.clients: "collections.OrderedDict[Tuple[str, str], TokenBucket]" = collections.OrderedDict()
+
+    def route_class(self, scope) -> Optional[str]:
+        if scope["method"] == "OPTIONS" or not scope["path"].startswith("/api/") or scope["path"] in self.exempt_paths:
+            return None
+        return "read" if scope["method"] in ("GET", "HEAD") else "write"
+
+    @staticmethod
+    def client_id(scope) -> str:
+        # Only a header set by a trusted proxy may stand in for the peer address;
+        # clients could otherwise rotate or spoof it. The proxy's entry is the last one.
+        if ADMISSION_CLIENT_HEADER:
+            for name, value in scope["headers"]:
+                if name.decode("latin-1") == ADMISSION_CLIENT_HEADER:
+                    return value.decode("latin-1").rsplit(",", 1)[-1].strip()
+        return scope["client"][0] if scope.get("client") else "unknown"
+
+    def rate_limited(self, scope, kind: str) -> Optional[float]:
+        rate = self.rates.get(kind, self.rates.get("*"))
+        if not rate:
+            return None
+        key = (kind, self.client_id(scope))
+        bucket = self.clients.get(key)
+        if bucket is None:
+            bucket = self.clients[key] = TokenBucket(rate, max(1.0, rate * ADMISSION_CLIENT_BURST))
+            if len(self.clients) > ADMISSION_CLIENTS_MAX:
+                self.clients.popitem(last=False)
+        else:
+            self.clients.move_to_end(key)
+        return None if bucket.take() else bucket.wait_time()
+
+    def stats(self) -> dict:
+        return {name: {"inFlight": gate.active, "queued": len(gate.waiters), "limit": gate.limit,
+                       "serviceTimeMs": round(gate.service_time * 1000, 2)}
+                for name, gate in self.gates.items()}
+
+
+admission = AdmissionControl(parse_limits(ADMISSION_CONCURRENCY), parse_limits(ADMISSION_CLIENT_RATES),
+                             ADMISSION_QUEUE_BUDGET_MS / 1000)
+
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def shed(self, scope, receive, send, kind: str, reason: str, retry_after: float):
+        http_shed.inc((kind, reason))
+        status, detail = (429, "Rate limit exceeded") if reason == "rate" else (503, "Server busy")
+        response = JSONResponse({"detail": detail}, status_code=status,
+                                headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        kind = admission.route_class(scope) if scope["type"] == "http" else None
+        if kind is None:
+            return await self.app(scope, receive, send)
+        retry_after = admission.rate_limited(scope, kind)
+        if retry_after is not None:
+            return await self.shed(scope, receive, send, kind, "rate", retry_after)
+        gate = admission.gates.get(kind)
+        if gate is None:
+            return await self.app(scope, receive, send)
+        rejected = await gate.acquire()
+        if rejected is not None:
+            return await self.shed(scope, receive, send, kind, *rejected)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.observe(time.perf_counter() - started)
+            gate.release()
+
+
 # ── Routes ──
 
 @api_router.get("/")
 async def root():
     return {"message": "Hello World"}
 
+@api_router.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready(request: Request):
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse({"status": "not_ready", "detail": "starting or draining"}, status_code=503)
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), READY_PING_TIMEOUT_MS / 1000)
+    except (asyncio.TimeoutError, PyMongoError) as e:
+        return JSONResponse({"status": "not_ready", "detail": f"mongo: {e!r}"}, status_code=503)
+    return {"status": "ready", "mongoPingMs": round((time.perf_counter() - started) * 1000, 3)}
+
 @api_router.post("/status", response_model=StatusCheck)
-async def create_status_check(input: StatusCheckCreate):
+async def create_status_check(
+    input: StatusCheckCreate,
+    durability: str = Query("ack", pattern="^(ack|fire)$"),
+):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
-    await db.status_checks.insert_one(doc)
-    return status_obj
+    if status_buffer is not None:
+        await status_buffer.submit(doc, wait=durability == "ack")
+    else:
+        await db.status_checks.insert_one(doc)
+    return Response(content=encode_status_check(doc), media_type="application/json")
+
+@api_router.get("/status/buffer")
+async def get_status_buffer():
+    if status_buffer is None:
+        return {"enabled": False}
+    return status_buffer.stats()
+
+@api_router.get("/admission")
+async def get_admission():
+    return {"gates": admission.stats(), "clients": len(admission.clients)}
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    lines = []
+    for metric in (http_requests, http_latency, http_response_size, http_mongo_commands, mongo_commands, mongo_latency,
+                   llm_jobs, llm_job_latency, http_shed):
+        lines += metric.render()
+    gauges = {
+        "agent_cache_version": ("Agent cache invalidations since start.", agent_cache.version),
+        "feed_subscribers": ("Connected live feed streams.", len(feed_broadcaster.subscribers)),
+        "feed_events_published_total": ("Feed events fanned out by this process.", feed_broadcaster.published),
+        "feed_subscriber_evictions_total": ("Feed streams dropped for falling behind.", feed_broadcaster.evictions),
+        "search_index_documents": ("Documents in the search index.", len(search_index.docs)),
+        "search_index_terms": ("Distinct terms in the search index.", len(search_index.terms)),
+        "template_cache_hits_total": ("Compiled template cache hits.", template_cache.hits),
+        "template_cache_misses_total": ("Compiled template cache misses.", template_cache.misses),
+        "llm_jobs_in_flight": ("LLM jobs running in this process.", sum(job_runner.inflight[k] for k in job_runner.inflight if "/" not in k)),
+    }
+    for name, gate in admission.stats().items():
+        gauges[f"admission_{name}_in_flight"] = (f"{name.capitalize()} requests holding an admission slot.", gate["inFlight"])
+        gauges[f"admission_{name}_queued"] = (f"{name.capitalize()} requests waiting for an admission slot.", gate["queued"])
+    if status_buffer is not None:
+        buf = status_buffer.stats()
+        gauges.update({
+            "status_buffer_queue_depth": ("Status checks waiting to be flushed.", buf["queueDepth"]),
+            "status_buffer_flushed_total": ("Status checks written by the batch buffer.", buf["flushed"]),
+            "status_buffer_failed_total": ("Status checks the batch buffer failed to write.", buf["failed"]),
+            "status_buffer_flush_p99_seconds": ("p99 of recent batch flush latencies.", buf["flushLatencyMs"]["p99"] / 1000),
+        })
+    for name, (help, value) in gauges.items():
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@api_router.get("/status/history")
+async def get_status_history(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    client_name: Optional[str] = None,
+    bucket: str = Query("hour", pattern="^(hour|day)$"),
+):
+    end = end or datetime.now(timezone.utc)
+    start = start or datetime.fromtimestamp(end.timestamp() - 7 * 86400, timezone.utc)
+    start, end = (t if t.tzinfo else t.replace(tzinfo=timezone.utc) for t in (start, end))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    series = await status_retention.history(start, end, client_name, bucket)
+    return {"start": start, "end": end, "bucket": bucket, "series": series}
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
-    for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
-    return status_checks
-
-@api_router.get("/agents", response_model=List[AgentDetail])
-async def get_agents():
-    agents = await db.agents.find({}, {"_id": 0}).to_list(100)
-    if not agents:
-        for seed in SEED_AGENTS:
-            await db.agents.insert_one({**seed})
-        agents = await db.agents.find({}, {"_id": 0}).to_list(100)
-    return agents
-
-@api_router.get("/agents/{agent_id}", response_model=AgentDetail)
-async def get_agent(agent_id: str):
-    agent = await db.agents.find_one({"id": agent_id}, {"_id": 0})
-    if not agent:
-        seed = next((a for a in SEED_AGENTS if a["id"] == agent_id), None)
-        if seed:
-            await db.agents.insert_one({**seed})
-            agent = await db.agents.find_one({"id": agent_id}, {"_id": 0})
-        else:
+async def get_status_checks(
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    query = decode_status_cursor(after) if after else {}
+    cursor = db.status_checks.find(query, {"_id": 0}).sort([("timestamp", 1), ("id", 1)])
+
+    if format == "ndjson":
+        if limit:
+            cursor = cursor.limit(limit)
+
+        async def stream():
+            async for doc in cursor.batch_size(500):
+                yield encode_status_check(doc) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    limit = min(limit or STATUS_PAGE_MAX, STATUS_PAGE_MAX)
+    docs = await cursor.limit(limit).to_list(limit)
+    headers = {}
+    if len(docs) == limit:
+        headers["X-Next-Cursor"] = encode_status_cursor(docs[-1])
+    body = "[" + ",".join(encode_status_check(d) for d in docs) + "]"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def agent_projection(fields: Optional[Tuple[str, ...]]) -> dict:
+    return {"_id": 0, **{f: 1 for f in fields}} if fields else {"_id": 0}
+
+# These return pre-serialized bodies, so the schema below is documentation only;
+# nothing is validated or filtered on the way out.
+AGENT_READ_RESPONSES = {
+    200: {"description": "AgentDetail JSON. With `fields` or `view=summary` only those fields (plus `id`) "
+                         "are present. Gzipped when the client accepts it. Carries an ETag."},
+    304: {"description": "The body matching If-None-Match has not changed."},
+    400: {"description": "Unknown `fields` entry or `view`."},
+}
+
+@api_router.get(
+    "/agents",
+    response_class=Response,
+    responses={**AGENT_READ_RESPONSES, 200: {**AGENT_READ_RESPONSES[200], "model": List[AgentDetail]}},
+)
+async def get_agents(request: Request, fields: Optional[str] = None, view: Optional[str] = None):
+    selected = parse_agent_fields(fields, view)
+    if agent_cache.ttl > 0:
+        snap = await agent_cache.snapshot()
+        if snap.complete:
+            return json_response(request, snap.list_view(selected))
+    docs = await db.agents.find({}, agent_projection(selected)).to_list(None)
+    body = dumps_json([project_agent(d, selected) for d in docs])
+    return json_response(request, CachedBody(body, make_etag(body)))
+
+# Declared before /agents/{agent_id} so "changes" and "activity" are not read as ids.
+@api_router.get("/agents/changes")
+async def get_agent_changes(since: int = Query(0, ge=0), limit: int = Query(500, ge=1, le=1000)):
+    visible, allocated = await agent_seq.high_water()
+    reset = since > allocated
+    if reset:
+        # The client synced against a different database; start it over.
+        since = 0
+    docs = await db.agents.find(
+        {"seq": {"$gt": since, "$lte": visible}}, {"_id": 0}
+    ).sort("seq", 1).limit(limit).to_list(limit)
+    more = len(docs) == limit
+    agents = agent_list_adapter.dump_python(agent_list_adapter.validate_python(docs), mode="json")
+    return {
+        "agents": agents,
+        "seq": docs[-1]["seq"] if more else max(visible, since),
+        "more": more,
+        "reset": reset,
+    }
+
+@api_router.get("/agents/activity")
+async def get_agent_activity(
+    range_key: str = Query("24h", alias="range", pattern="^(" + "|".join(ACTIVITY_RANGES) + ")$"),
+):
+    return await activity_rollup.read(range_key)
+
+@api_router.get(
+    "/agents/{agent_id}",
+    response_class=Response,
+    responses={
+        **AGENT_READ_RESPONSES,
+        200: {**AGENT_READ_RESPONSES[200], "model": AgentDetail},
+        404: {"description": "Agent not found"},
+    },
+)
+async def get_agent(agent_id: str, request: Request, fields: Optional[str] = None, view: Optional[str] = None):
+    selected = parse_agent_fields(fields, view)
+    if agent_cache.ttl > 0:
+        snap = await agent_cache.snapshot()
+        cached = snap.agent_view(agent_id, selected)
+        if cached is not None:
+            return json_response(request, cached)
+        if snap.complete:
             raise HTTPException(status_code=404, detail="Agent not found")
-    return agent
+    projection = agent_projection(selected + ("version",) if selected else None)
+    doc = await db.agents.find_one({"id": agent_id}, projection)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    body = dumps_json(project_agent(doc, selected))
+    return json_response(request, CachedBody(body, agent_etag(doc.get("version") or 0, body)))
 
-@api_router.put("/agents/{agent_id}", response_model=AgentDetail)
-async def update_agent(agent_id: str, update: AgentUpdate):
-    update_data = {k: v for k, v in update.model_dump().items() if v is not None}
+def agent_update_data(agent_id: str, update: AgentUpdate) -> dict:
+    update_data = {k: v for k, v in update.model_dump(include=set(AgentUpdate.model_fields)).items() if v is not None}
     if update_data.get("promptTemplates") is not None:
         update_data["promptTemplates"] = [t if isinstance(t, dict) else t.model_dump() for t in update_data["promptTemplates"]]
+        validate_templates(agent_id, update_data["promptTemplates"])
+    return update_data
+
+def agent_query(agent_id: str, expected: Optional[int]) -> dict:
+    query = {"id": agent_id}
+    if expected is not None:
+        # Documents written before versioning have no version field.
+        query["version"] = {"$in": [0, None]} if expected == 0 else expected
+    return query
 
-    existing = await db.agents.find_one({"id": agent_id}, {"_id": 0})
-    if not existing:
-        seed = next((a for a in SEED_AGENTS if a["id"] == agent_id), None)
-        if seed:
-            await db.agents.insert_one({**seed})
+def agent_update_ops(update_data: dict, seq: int, at: datetime) -> dict:
+    return {"$inc": {"version": 1}, "$set": {**update_data, "seq": seq, "seqAt": at}}
+
+# Bulk writes also log their seq here. A later write can replace seq before
+# the batch is read back, and the log still shows whether this write landed.
+AGENT_RECENT_SEQS = 16
+
+def agent_update_event(agent: AgentDetail, update_data: dict) -> dict:
+    if "status" in update_data:
+        return make_event("status_update", agent.id, f"is now {agent.status}")
+    return make_event("status_update", agent.id, "updated configuration", ", ".join(sorted(update_data)))
+
+# Round trips per call: the filter find (filter form only), one counter $inc
+# for the whole batch's seqs, the bulk_write, a find reading the batch back,
+# and one insert_many of the feed events. Activity counts are flushed later.
+@api_router.patch("/agents")
+async def bulk_update_agents(batch: AgentBulkUpdate):
+    if batch.items is not None:
+        if batch.filter is not None or batch.update is not None:
+            raise HTTPException(status_code=422, detail="Send either items, or filter and update, not both")
+    elif batch.filter is None or batch.update is None:
+        raise HTTPException(status_code=422, detail="Send either items, or filter and update")
+    errors = []
+    if batch.items is not None:
+        items = batch.items
+    else:
+        # Resolve the filter up front so each write can be pinned to the version it matched.
+        query = {k: v for k, v in batch.filter.model_dump(exclude={"ids"}).items() if v is not None}
+        if batch.filter.ids is not None:
+            query["id"] = {"$in": batch.filter.ids}
+        if not query:
+            # An empty filter would rewrite every agent; that has to be asked for by listing ids.
+            raise HTTPException(status_code=422, detail="filter must set at least one of ids, llmProvider, llmModel or status")
+        matched = await db.agents.find(query, {"_id": 0, "id": 1, "version": 1}).to_list(None)
+        items = [AgentBulkItem(id=d["id"], version=d.get("version") or 0, **batch.update.model_dump()) for d in matched]
+
+    planned, seen = [], set()
+    for item in items:
+        if item.id in seen:
+            errors.append({"id": item.id, "detail": "Duplicate id in batch"})
+            continue
+        seen.add(item.id)
+        try:
+            update_data = agent_update_data(item.id, item)
+        except HTTPException as e:
+            errors.append({"id": item.id, "detail": e.detail})
+            continue
+        planned.append((item, update_data))
+    if planned:
+        first, at = await agent_seq.allocate(len(planned))
+        planned = [(item, data, first + i) for i, (item, data) in enumerate(planned)]
+        ops = [
+            UpdateOne(agent_query(item.id, item.version), {
+                **agent_update_ops(data, seq, at),
+                "$push": {"recentSeqs": {"$each": [seq], "$slice": -AGENT_RECENT_SEQS}},
+            })
+            for item, data, seq in planned
+        ]
+        try:
+            await db.agents.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "write error") for err in e.details.get("writeErrors", [])}
+            errors.extend({"id": planned[i][0].id, "detail": msg} for i, msg in failed.items())
+            planned = [p for i, p in enumerate(planned) if i not in failed]
+        agent_cache.invalidate()
+
+    # Bulk results only carry totals, so read the batch back to attribute each write.
+    by_id = {}
+    if planned:
+        async for doc in db.agents.find({"id": {"$in": [item.id for item, _, _ in planned]}}, {"_id": 0}):
+            by_id[doc["id"]] = doc
+    updated, events = [], []
+    for item, update_data, seq in planned:
+        doc = by_id.get(item.id)
+        if doc is None:
+            errors.append({"id": item.id, "detail": "Agent not found"})
+        elif seq not in (doc.get("recentSeqs") or ()):
+            errors.append({"id": item.id, "detail": "Agent was modified by another request"})
         else:
-            raise HTTPException(status_code=404, detail="Agent not found")
+            # The document may already carry a later write; report what this one set.
+            agent = AgentDetail.model_validate({**doc, **update_data})
+            version = item.version + 1 if item.version is not None else agent.version
+            search_index.add_agent(doc)
+            events.append(agent_update_event(agent, update_data))
+            updated.append({"id": agent.id, "version": version})
+    await record_events(events)
+    return {"updated": updated, "errors": errors}
+
+@api_router.put("/agents/{agent_id}", response_model=AgentDetail)
+async def update_agent(agent_id: str, update: AgentUpdate, if_match: Optional[str] = Header(None)):
+    update_data = agent_update_data(agent_id, update)
+    expected = parse_if_match(if_match)
+    query = agent_query(agent_id, expected)
+    seed = SEED_AGENTS_BY_ID.get(agent_id) if expected is None else None
+
+    ops = agent_update_ops(update_data, *await agent_seq.allocate())
+    if seed:
+        ops["$setOnInsert"] = {k: v for k, v in seed.items() if k not in update_data}
+    try:
+        doc = await db.agents.find_one_and_update(
+            query, ops, projection={"_id": 0},
+            return_document=ReturnDocument.AFTER, upsert=seed is not None,
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Agent was modified by another request")
+    if doc is None:
+        if expected is not None and await db.agents.count_documents({"id": agent_id}, limit=1):
+            raise HTTPException(status_code=409, detail="Agent was modified by another request")
+        raise HTTPException(status_code=404, detail="Agent not found")
+    agent_cache.invalidate()
+
+    agent = AgentDetail.model_validate(doc)
+    search_index.add_agent(doc)
+    await record_events([agent_update_event(agent, update_data)])
+    body = agent.model_dump_json().encode()
+    return Response(content=body, media_type="application/json", headers={"ETag": agent_etag(agent.version, body)})
+
+@api_router.post("/agents/{agent_id}/templates/render")
+async def render_templates(agent_id: str, req: TemplateRenderRequest):
+    agent = await agent_cache.get(agent_id)
+    if agent is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    tpl = next((t for t in agent.promptTemplates if t.name == req.template), None)
+    if tpl is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    compiled = template_cache.get(agent_id, tpl.name, tpl.template)
+
+    if req.stream:
+        async def stream():
+            for i, values in enumerate(req.variables):
+                yield json.dumps(render_result(i, compiled, values, req.strict)) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    results = [render_result(i, compiled, values, req.strict) for i, values in enumerate(req.variables)]
+    rendered = [r for r in results if "text" in r]
+    return {
+        "agentId": agent_id,
+        "template": tpl.name,
+        "variables": list(compiled.variables),
+        "results": results,
+        "rendered": len(rendered),
+        "failed": len(results) - len(rendered),
+        "totalChars": sum(r["chars"] for r in rendered),
+        "totalTokens": sum(r["tokens"] for r in rendered),
+    }
+
+@api_router.post("/tasks", response_model=Task)
+async def create_task(input: TaskCreate):
+    now = datetime.now(timezone.utc)
+    doc = input.model_dump(exclude={"actorId"})
+    doc.update(
+        id=str(uuid.uuid4()),
+        rank=rank_between(await column_tail_rank(input.column), None),
+        createdAt=now,
+        updatedAt=now,
+        movedAt=now,
+    )
+    # insert_one adds _id to the dict it is given, so hand it a copy and keep doc clean for the response.
+    record = dict(doc)
+    await db.tasks.insert_one(record)
+    search_index.add_task(record)
+    await standup_digest.apply_tasks([record])
+    await emit_event("task_created", input.actorId or input.assigneeId or "", "created", doc["title"], doc["id"])
+    return doc
+
+@api_router.get("/tasks", response_model=List[Task])
+async def get_tasks(
+    column: str = Query(pattern=COLUMN_PATTERN),
+    after: Optional[str] = None,
+    limit: int = Query(200, ge=1, le=1000),
+):
+    query = {"column": column}
+    if after:
+        rank, task_id = decode_cursor(after, 2)
+        query["$or"] = [{"rank": {"$gt": rank}}, {"rank": rank, "id": {"$gt": task_id}}]
+    docs = await db.tasks.find(query, {"_id": 0}).sort([("rank", 1), ("id", 1)]).limit(limit).to_list(limit)
+    headers = {}
+    if len(docs) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(docs[-1]["rank"], docs[-1]["id"])
+    body = TypeAdapter(List[Task]).dump_json([Task.model_validate(d) for d in docs])
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/tasks/counts")
+async def get_task_counts():
+    counts = await asyncio.gather(*(db.tasks.count_documents({"column": c}) for c in KANBAN_COLUMNS))
+    return dict(zip(KANBAN_COLUMNS, counts))
+
+@api_router.post("/tasks/bulk-move")
+async def bulk_move_tasks(batch: TaskMoveBatch):
+    planned, errors = await plan_task_moves(batch.moves)
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne({"id": m.id}, {"$set": {"column": m.column, "rank": rank, "updatedAt": now,
+                                          **({"movedAt": now} if m.column != frm else {})}})
+        for m, frm, rank, _ in planned
+    ]
+    if ops:
+        try:
+            await db.tasks.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "write error") for err in e.details.get("writeErrors", [])}
+            errors.extend({"id": planned[i][0].id, "detail": msg} for i, msg in failed.items())
+            planned = [p for i, p in enumerate(planned) if i not in failed]
+    for m, _, _, _ in planned:
+        search_index.touch("tasks", m.id, column=m.column)
+    await standup_digest.apply_tasks([
+        {**task, "column": m.column, "movedAt": now} for m, frm, _, task in planned if m.column != frm
+    ])
+    await record_events([ev for ev in (move_event(m, frm, task) for m, frm, _, task in planned) if ev])
+    return {
+        "moved": [{"id": m.id, "column": m.column, "rank": rank} for m, _, rank, _ in planned],
+        "errors": errors,
+    }
+
+@api_router.get("/tasks/{task_id}", response_model=Task)
+async def get_task(task_id: str):
+    doc = await db.tasks.find_one({"id": task_id}, {"_id": 0})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return doc
+
+@api_router.patch("/tasks/{task_id}", response_model=Task)
+async def update_task(task_id: str, update: TaskUpdate):
+    update_data = {k: v for k, v in update.model_dump().items() if v is not None}
+    update_data["updatedAt"] = datetime.now(timezone.utc)
+    doc = await db.tasks.find_one_and_update(
+        {"id": task_id}, {"$set": update_data},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail="Task not found")
+    search_index.add_task(doc)
+    await standup_digest.apply_tasks([doc])
+    return doc
 
-    if update_data:
-        await db.agents.update_one({"id": agent_id}, {"$set": update_data})
+@api_router.post("/tasks/{task_id}/move", response_model=Task)
+async def move_task(task_id: str, target: TaskMoveTarget):
+    move = TaskMove(id=task_id, **target.model_dump())
+    planned, errors = await plan_task_moves([move])
+    if errors:
+        status = 404 if errors[0]["detail"] == "Task not found" else 409
+        raise HTTPException(status_code=status, detail=errors[0]["detail"])
+    _, from_column, rank, task = planned[0]
+    now = datetime.now(timezone.utc)
+    fields = {"column": move.column, "rank": rank, "updatedAt": now}
+    if move.column != from_column:
+        fields["movedAt"] = now
+    doc = await db.tasks.find_one_and_update(
+        {"id": task_id}, {"$set": fields},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+    )
+    if not doc:
+        raise HTTPException(status_code=404, detail="Task not found")
+    search_index.touch("tasks", task_id, column=move.column)
+    event = move_event(move, from_column, task)
+    if event:
+        await standup_digest.apply_tasks([doc])
+        await record_events([event])
+    return doc
 
-    updated = await db.agents.find_one({"id": agent_id}, {"_id": 0})
-    return updated
+@api_router.delete("/tasks/{task_id}", status_code=204)
+async def delete_task(task_id: str):
+    result = await db.tasks.delete_one({"id": task_id})
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Task not found")
+    search_index.remove_task(task_id)
+    await standup_digest.apply_tasks(removed=[task_id])
+    return Response(status_code=204)
 
+@api_router.get("/standup")
+async def get_standup(
+    window: str = Query("all", pattern="^(all|since-last)$"),
+    since: Optional[datetime] = None,
+):
+    if since is None and window == "since-last":
+        doc = await db.standup.find_one({"_id": standup_digest.doc_id}, {"lastStandupAt": 1})
+        since = (doc or {}).get("lastStandupAt")
+    elif since is not None and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return await standup_digest.read(since)
 
+@api_router.post("/standup/close")
+async def close_standup():
+    return {"lastStandupAt": await standup_digest.close()}
+
+@api_router.post("/standup/rebuild")
+async def rebuild_standup():
+    return await standup_digest.rebuild()
+
+@api_router.get("/search")
+async def search(
+    q: str = Query(min_length=1, max_length=200),
+    types: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=50),
+):
+    kinds = SEARCH_KINDS
+    if types:
+        kinds = tuple(t.strip() for t in types.split(",") if t.strip())
+        unknown = set(kinds).difference(SEARCH_KINDS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown search types: {', '.join(sorted(unknown))}")
+    started = time.perf_counter()
+    groups = search_index.search(q, kinds, limit)
+    return {"query": q, "groups": groups, "tookMs": round((time.perf_counter() - started) * 1000, 3)}
+
+@api_router.post("/jobs", status_code=202)
+async def create_job(req: JobCreate):
+    agent = await agent_cache.get(req.agentId)
+    if agent is None:
+        raise HTTPException(status_code=404, detail="Agent not found")
+    if (req.template is None) == (req.prompt is None):
+        raise HTTPException(status_code=422, detail="Send either template or prompt")
+    if req.template is not None:
+        tpl = next((t for t in agent.promptTemplates if t.name == req.template), None)
+        if tpl is None:
+            raise HTTPException(status_code=404, detail="Template not found")
+        compiled = template_cache.get(agent.id, tpl.name, tpl.template)
+        missing = compiled.missing(req.variables)
+        if missing:
+            raise HTTPException(status_code=422, detail=f"Missing variables: {', '.join(missing)}")
+        prompt = compiled.render(req.variables)
+    else:
+        prompt = req.prompt
+
+    provider = agent.llmProvider or LLM_FALLBACK_PROVIDER
+    key = job_key(provider, agent.llmModel, agent.systemInstructions, prompt)
+    now = datetime.now(timezone.utc)
+    doc = {
+        "id": str(uuid.uuid4()),
+        "agentId": agent.id,
+        "provider": provider,
+        "model": agent.llmModel,
+        "modelKey": f"{provider}/{agent.llmModel}",
+        "system": agent.systemInstructions,
+        "prompt": prompt,
+        "template": req.template,
+        "status": "queued",
+        "attempts": 0,
+        "maxAttempts": req.maxAttempts,
+        "runAt": now,
+        "createdAt": now,
+        "updatedAt": now,
+        "activeKey": key,
+    }
+    for _ in range(2):
+        try:
+            await db.jobs.insert_one(doc)
+        except DuplicateKeyError:
+            existing = await db.jobs.find_one({"activeKey": key})
+            if existing is not None:
+                return {**public_job(existing), "coalesced": True}
+            # The matching job finished between the insert and the lookup.
+            doc.pop("_id", None)
+            continue
+        job_runner.wakeup.set()
+        return {**public_job(doc), "coalesced": False}
+    raise HTTPException(status_code=409, detail="Job could not be queued, retry")
+
+@api_router.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = Query(None, pattern="^(" + "|".join(JOB_STATUSES) + ")$"),
+    agentId: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+):
+    query = {}
+    if status:
+        query["status"] = status
+    if agentId:
+        query["agentId"] = agentId
+    docs = await db.jobs.find(query).sort("_id", -1).limit(limit).to_list(limit)
+    return [public_job(d) for d in docs]
+
+@api_router.get("/jobs/stats")
+async def get_job_stats():
+    counts = await db.jobs.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]).to_list(None)
+    by_status = {s: 0 for s in JOB_STATUSES}
+    by_status.update({c["_id"]: c["n"] for c in counts})
+    return {"jobs": by_status, "runner": job_runner.stats()}
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    doc = await db.jobs.find_one({"id": job_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_job(doc)
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    now = datetime.now(timezone.utc)
+    doc = await db.jobs.find_one_and_update(
+        {"id": job_id, "status": "queued"},
+        {"$set": {"status": "cancelled", "finishedAt": now, "updatedAt": now}, "$unset": {"activeKey": ""}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if doc is None:
+        if await db.jobs.count_documents({"id": job_id}, limit=1):
+            raise HTTPException(status_code=409, detail="Only queued jobs can be cancelled")
+        raise HTTPException(status_code=404, detail="Job not found")
+    return public_job(doc)
+
+@api_router.get("/feed")
+async def get_feed(
+    tab: Optional[str] = None,
+    types: Optional[str] = None,
+    agentId: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+):
+    query = {}
+    wanted = resolve_feed_types(tab, types)
+    if wanted is not None:
+        query["type"] = {"$in": sorted(wanted)}
+    if agentId:
+        query["agentId"] = agentId
+    if before:
+        query["_id"] = {"$lt": parse_event_id(before)}
+    docs = await db.events.find(query).sort("_id", -1).limit(limit).to_list(limit)
+    return [public_event(d) for d in docs]
+
+@api_router.post("/feed")
+async def create_feed_event(input: FeedEventCreate):
+    doc = await emit_event(input.type, input.agentId, input.action, input.target, input.targetId, input.detail)
+    if doc is None:
+        raise HTTPException(status_code=503, detail="Event could not be recorded")
+    return public_event(doc)
+
+@api_router.get("/feed/stream")
+async def stream_feed(
+    tab: Optional[str] = None,
+    types: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    wanted = resolve_feed_types(tab, types)
+    resume_from = parse_event_id(last_event_id) if last_event_id else None
+    sub = feed_broadcaster.subscribe(wanted)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            replayed = set()
+            if resume_from is not None:
+                query = {"_id": {"$gt": resume_from}}
+                if wanted is not None:
+                    query["type"] = {"$in": sorted(wanted)}
+                docs = await db.events.find(query).sort("_id", 1).limit(FEED_REPLAY_MAX + 1).to_list(None)
+                if len(docs) > FEED_REPLAY_MAX:
+                    # Too far behind to replay: tell the client to refetch /api/feed, and move
+                    # its Last-Event-ID to the newest event so the next reconnect resumes from there.
+                    newest = await db.events.find_one(query, {"_id": 1}, sort=[("_id", -1)])
+                    yield encode_feed_reset(newest["_id"])
+                else:
+                    for doc in docs:
+                        replayed.add(str(doc["_id"]))
+                        yield encode_feed_frame(doc)
+            while not sub.evicted:
+                try:
+                    event_id, frame = await asyncio.wait_for(sub.queue.get(), FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event_id not in replayed:
+                    yield frame
+        finally:
+            feed_broadcaster.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+background_tasks: List[asyncio.Task] = []
+
+
+async def warm_pool(connections: int):
+    # Concurrent pings each check out a socket, so the pool opens up to
+    # ``connections`` of them now instead of on the first real requests.
+    await asyncio.gather(*(db.command("ping") for _ in range(max(1, min(connections, MONGO_MAX_POOL_SIZE)))))
+
+
+async def prime_caches():
+    snap = await agent_cache.snapshot()
+    snap.list_view()
+    for agent in snap.agents.values():
+        for tpl in agent.promptTemplates:
+            template_cache.get(agent.id, tpl.name, tpl.template)
+    if await db.standup.count_documents({"_id": standup_digest.doc_id}, limit=1) == 0:
+        await standup_digest.rebuild()
+    try:
+        await asyncio.wait_for(search_index.loaded.wait(), STARTUP_PRIME_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Search index not loaded after %.0fs, serving partial results until it is",
+                       STARTUP_PRIME_TIMEOUT_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    app.state.ready = False
+    await warm_pool(WARM_POOL_CONNECTIONS)
+    await ensure_indexes()
+    await migrate_status_timestamps()
+    await migrate_task_ranks()
+    await seed_agents()
+    await backfill_agent_seq()
+    background_tasks.append(asyncio.create_task(agent_cache.watch()))
+    background_tasks.append(asyncio.create_task(feed_broadcaster.watch()))
+    background_tasks.append(asyncio.create_task(search_index.watch()))
+    background_tasks.append(asyncio.create_task(activity_rollup.run()))
+    background_tasks.append(asyncio.create_task(status_retention.run()))
+    await prime_caches()
+    if status_buffer is not None:
+        status_buffer.start()
+    activity_rollup.start()
+    job_runner.start()
+    app.state.ready = True
+    logger.info("Ready in %.0f ms", (time.perf_counter() - started) * 1000)
+    try:
+        yield
+    finally:
+        # Probes arriving during shutdown report not-ready rather than hitting a closed client.
+        app.state.ready = False
+        for task in background_tasks:
+            task.cancel()
+        background_tasks.clear()
+        await job_runner.stop()
+        for provider in llm_providers.values():
+            await provider.aclose()
+        if status_buffer is not None:
+            await status_buffer.stop()
+        await activity_rollup.stop()
+        client.close()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(api_router)
 
+# Inside CORS so rejections still carry CORS headers the dashboard can read.
+app.add_middleware(AdmissionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Retry-After"],
 )
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+class SelectiveGZipMiddleware(GZipMiddleware):
+    # Compressing an event stream would hold events in the gzip buffer.
+    skip_paths = ("/api/feed/stream",)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.skip_paths:
+            return await self.app(scope, receive, send)
+        await super().__call__(scope, receive, send)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=6)
+app.add_middleware(MetricsMiddleware)
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Offline load test and benchmark suite for the Mission Control backend.
+
+Drives backend/server.py in-process through an ASGI client, or over a real
+uvicorn socket, against either an in-memory Motor stand-in (mongomock-motor)
+or a disposable local mongod. Nothing leaves the machine.
+
+Scenarios: cold_start, roster_polling, concurrent_agent_edits,
+status_ingest_burst, large_status_scan. Each reports p50/p95/p99 latency,
+requests per second and Mongo operations per request, and the run is saved
+as JSON under test_reports/benchmarks/ so results can be compared across
+commits (--compare).
+
+Examples:
+    python backend_bench.py
+    python backend_bench.py --mode both --scenario roster_polling
+    python backend_bench.py --store mongod --mongod-bin /usr/bin/mongod
+    python backend_bench.py --compare test_reports/benchmarks/<previous>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+REPORT_DIR = ROOT_DIR / "test_reports" / "benchmarks"
+
+# server.py reads these at import time; the store swaps the real database in afterwards.
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:27017")
+os.environ.setdefault("DB_NAME", "bench")
+# Jobs for providers without an API key run on the offline stub instead of failing.
+os.environ.setdefault("LLM_FALLBACK_PROVIDER", "stub")
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+import httpx  # noqa: E402
+from pymongo.errors import OperationFailure  # noqa: E402
+
+import server  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# ── Stores ──
+
+class CountingCollection:
+    """Wraps a mongomock-motor collection, counting each operation it serves.
+
+    Also makes the stand-in behave like a standalone mongod where the two
+    differ in ways the server depends on.
+    """
+
+    def __init__(self, collection, store):
+        self._collection = collection
+        self._store = store
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if callable(attr) and not name.startswith("_"):
+            self._store.ops += 1
+        return attr
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+
+    async def find_one_and_update(self, filter, update, projection=None, return_document=None, **kwargs):
+        self._store.ops += 1
+        # mongomock re-runs the original filter to fetch the AFTER document when
+        # _id is projected out, which misses once a filtered field has changed.
+        doc = await self._collection.find_one_and_update(filter, update, return_document=return_document, **kwargs)
+        if doc is not None and projection:
+            doc = {k: v for k, v in doc.items() if projection.get(k, 1)}
+        return doc
+
+
+class CountingDatabase:
+    def __init__(self, database, store):
+        self._database = database
+        self._store = store
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._database, name), self._store)
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self._store)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", 40573)
+
+    async def command(self, *args, **kwargs):
+        self._store.ops += 1
+        return await self._database.command(*args, **kwargs)
+
+
+class MemoryStore:
+    name = "memory"
+
+    def __init__(self):
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("The in-memory store needs mongomock-motor: pip install mongomock-motor")
+        self._client_class = AsyncMongoMockClient
+        self.ops = 0
+
+    async def start(self):
+        pass
+
+    async def fresh(self, name):
+        client = self._client_class(tz_aware=True)
+        server.client = client
+        server.db = CountingDatabase(client[name], self)
+
+    def op_count(self):
+        return self.ops
+
+    async def stop(self):
+        pass
+
+
+class MongodStore:
+    name = "mongod"
+
+    def __init__(self, mongod_bin=None, mongo_url=None):
+        self.mongod_bin = mongod_bin
+        self.mongo_url = mongo_url
+        self.process = None
+        self.dbpath = None
+        self.databases = []
+
+    async def start(self):
+        if self.mongo_url is None:
+            binary = self.mongod_bin or shutil.which("mongod")
+            if not binary:
+                sys.exit("No mongod found: pass --mongod-bin or --mongo-url, or use --store memory")
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+            self.dbpath = tempfile.mkdtemp(prefix="claw-bench-")
+            self.process = subprocess.Popen(
+                [binary, "--dbpath", self.dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            self.mongo_url = f"mongodb://127.0.0.1:{port}"
+        probe = server.AsyncIOMotorClient(self.mongo_url, serverSelectionTimeoutMS=500)
+        for _ in range(60):
+            try:
+                await probe.admin.command("ping")
+                break
+            except Exception:
+                await asyncio.sleep(0.5)
+        else:
+            sys.exit(f"mongod at {self.mongo_url} did not become ready")
+        probe.close()
+
+    async def fresh(self, name):
+        client = server.AsyncIOMotorClient(
+            self.mongo_url, tz_aware=True, event_listeners=[server.MongoCommandListener()]
+        )
+        db_name = f"bench_{name}_{os.getpid()}"
+        await client.drop_database(db_name)
+        self.databases.append(db_name)
+        server.client = client
+        server.db = client[db_name]
+
+    def op_count(self):
+        # Sum of per-request command counts recorded by the metrics middleware.
+        return sum(entry[1] for entry in server.http_mongo_commands.series.values())
+
+    async def stop(self):
+        if self.process is None:
+            client = server.AsyncIOMotorClient(self.mongo_url)
+            for name in self.databases:
+                await client.drop_database(name)
+            client.close()
+            return
+        self.process.terminate()
+        self.process.wait(timeout=30)
+        shutil.rmtree(self.dbpath, ignore_errors=True)
+
+
+# ── Transports ──
+
+class Lifespan:
+    """Runs the app's ASGI lifespan so startup work happens exactly as under uvicorn."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __aenter__(self):
+        self.receive_queue = asyncio.Queue()
+        self.send_queue = asyncio.Queue()
+        await self.receive_queue.put({"type": "lifespan.startup"})
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}
+        self.task = asyncio.create_task(self.app(scope, self.receive_queue.get, self.send_queue.put))
+        message = await self.send_queue.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Startup failed: {message}")
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.receive_queue.put({"type": "lifespan.shutdown"})
+        await self.send_queue.get()
+        await self.task
+
+
+class AsgiTarget:
+    name = "asgi"
+
+    async def __aenter__(self):
+        self.lifespan = Lifespan(server.app)
+        await self.lifespan.__aenter__()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench")
+        return self.client
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        await self.lifespan.__aexit__(*exc)
+
+
+class UvicornTarget:
+    name = "uvicorn"
+
+    async def __aenter__(self):
+        import uvicorn
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.task = asyncio.create_task(self.server.serve())
+        while not self.server.started:
+            await asyncio.sleep(0.01)
+        limits = httpx.Limits(max_connections=200, max_keepalive_connections=200)
+        self.client = httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60)
+        return self.client
+
+    async def __aexit__(self, *exc):
+        await self.client.aclose()
+        self.server.should_exit = True
+        await self.task
+
+
+# ── Scenarios ──
+
+class Scenario:
+    """A named workload: optional setup, then `requests` calls at `concurrency`.
+
+    `make_request(i)` returns (method, url, httpx kwargs); `hook(response, url)`
+    lets a scenario carry state such as versions or cursors between requests.
+    """
+
+    def __init__(self, name, requests, concurrency, make_request, setup=None, hook=None):
+        self.name = name
+        self.requests = requests
+        self.concurrency = concurrency
+        self.make_request = make_request
+        self.setup = setup
+        self.hook = hook
+
+
+async def seed_status_checks(count):
+    now = datetime.now(timezone.utc).timestamp()
+    batch = []
+    for i in range(count):
+        batch.append({
+            "id": f"bench-{i:08d}",
+            "client_name": f"client-{i % 50}",
+            "timestamp": datetime.fromtimestamp(now - count + i, timezone.utc),
+        })
+        if len(batch) == 5000:
+            await server.db.status_checks.insert_many(batch)
+            batch = []
+    if batch:
+        await server.db.status_checks.insert_many(batch)
+
+
+def build_scenarios(scale):
+    n = lambda base: max(1, int(base * scale))  # noqa: E731
+    agent_ids = [a["id"] for a in server.SEED_AGENTS]
+    state = {}
+
+    async def remember_roster_etag(client):
+        state["etag"] = (await client.get("/api/agents")).headers["etag"]
+
+    def roster_poll(i):
+        # Most dashboards poll with the ETag they already hold.
+        headers = {"If-None-Match": state["etag"]} if i % 5 else {}
+        return "GET", "/api/agents", {"headers": headers}
+
+    async def load_versions(client):
+        roster = (await client.get("/api/agents")).json()
+        state["versions"] = {a["id"]: a["version"] for a in roster}
+
+    def agent_edit(i):
+        agent_id = random.choice(agent_ids)
+        version = state["versions"][agent_id]
+        body = {"status": random.choice(["WORKING", "IDLE"])}
+        return "PUT", f"/api/agents/{agent_id}", {"json": body, "headers": {"If-Match": f'"{version}"'}}
+
+    def on_edit(response, url):
+        if response.status_code == 200:
+            state["versions"][url.rsplit("/", 1)[-1]] = response.json()["version"]
+
+    async def seed_scan(client):
+        await seed_status_checks(n(50000))
+        state["cursor"] = None
+
+    def scan_page(i):
+        params = {"limit": 1000}
+        if state.get("cursor"):
+            params["after"] = state["cursor"]
+        return "GET", "/api/status", {"params": params}
+
+    return [
+        Scenario("cold_start", n(200), 50, lambda i: ("GET", "/api/agents", {})),
+        Scenario("roster_polling", n(2000), 50, roster_poll, setup=remember_roster_etag),
+        Scenario("concurrent_agent_edits", n(500), 20, agent_edit, setup=load_versions, hook=on_edit),
+        Scenario("status_ingest_burst", n(5000), 100,
+                 lambda i: ("POST", "/api/status", {"json": {"client_name": f"client-{i % 50}"}})),
+        Scenario("large_status_scan", n(50), 1, scan_page, setup=seed_scan,
+                 hook=lambda response, url: state.update(cursor=response.headers.get("x-next-cursor"))),
+    ]
+
+
+# ── Runner ──
+
+class BenchmarkRunner:
+    def __init__(self, store, scale):
+        self.store = store
+        self.scale = scale
+        self.results = []
+
+    async def run_scenario(self, scenario, target_class):
+        await self.store.fresh(scenario.name)
+        server.agent_cache.invalidate()
+        target = target_class()
+        print(f"\n⏱  {scenario.name} [{target.name}/{self.store.name}] "
+              f"{scenario.requests} requests @ concurrency {scenario.concurrency}")
+
+        started = time.perf_counter()
+        client = await target.__aenter__()
+        startup_ms = (time.perf_counter() - started) * 1000
+        try:
+            if scenario.setup:
+                await scenario.setup(client)
+            latencies, statuses = [], {}
+            counter = iter(range(scenario.requests))
+            ops_before = self.store.op_count()
+
+            async def worker():
+                for i in counter:
+                    method, url, kwargs = scenario.make_request(i)
+                    t0 = time.perf_counter()
+                    response = await client.request(method, url, **kwargs)
+                    latencies.append(time.perf_counter() - t0)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if scenario.hook:
+                        scenario.hook(response, url)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(scenario.concurrency)))
+            wall = time.perf_counter() - t0
+            ops = self.store.op_count() - ops_before
+        finally:
+            await target.__aexit__(None, None, None)
+
+        result = {
+            "scenario": scenario.name,
+            "transport": target.name,
+            "store": self.store.name,
+            "requests": len(latencies),
+            "concurrency": scenario.concurrency,
+            "statuses": {str(k): v for k, v in sorted(statuses.items())},
+            "startupMs": round(startup_ms, 2),
+            "wallSeconds": round(wall, 4),
+            "rps": round(len(latencies) / wall, 1) if wall else 0.0,
+            "latencyMs": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 3),
+                "p95": round(percentile(latencies, 0.95) * 1000, 3),
+                "p99": round(percentile(latencies, 0.99) * 1000, 3),
+                "max": round(max(latencies, default=0.0) * 1000, 3),
+            },
+            "mongoOpsPerRequest": round(ops / len(latencies), 3) if latencies else 0.0,
+        }
+        lat = result["latencyMs"]
+        print(f"   {result['rps']} req/s  p50 {lat['p50']}ms  p95 {lat['p95']}ms  p99 {lat['p99']}ms  "
+              f"mongo ops/req {result['mongoOpsPerRequest']}  statuses {result['statuses']}")
+        self.results.append(result)
+        return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, previous_path):
+    previous = json.loads(Path(previous_path).read_text())
+    baseline = {(r["scenario"], r["transport"], r["store"]): r for r in previous["results"]}
+    print(f"\n📊 Compared with {previous.get('revision', '?')} ({previous_path}):")
+    for r in results:
+        base = baseline.get((r["scenario"], r["transport"], r["store"]))
+        if not base:
+            continue
+        delta = lambda new, old: f"{(new - old) / old * 100:+.1f}%" if old else "n/a"  # noqa: E731
+        print(f"  • {r['scenario']} [{r['transport']}]: "
+              f"rps {delta(r['rps'], base['rps'])}, "
+              f"p99 {delta(r['latencyMs']['p99'], base['latencyMs']['p99'])}, "
+              f"mongo ops/req {base['mongoOpsPerRequest']} → {r['mongoOpsPerRequest']}")
+
+
+async def run(args):
+    store = MemoryStore() if args.store == "memory" else MongodStore(args.mongod_bin, args.mongo_url)
+    await store.start()
+    runner = BenchmarkRunner(store, args.scale)
+    targets = {"asgi": [AsgiTarget], "uvicorn": [UvicornTarget], "both": [AsgiTarget, UvicornTarget]}[args.mode]
+    try:
+        for target_class in targets:
+            for scenario in build_scenarios(args.scale):
+                if args.scenario and scenario.name not in args.scenario:
+                    continue
+                await runner.run_scenario(scenario, target_class)
+    finally:
+        await store.stop()
+    return runner.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["asgi", "uvicorn", "both"], default="asgi")
+    parser.add_argument("--store", choices=["memory", "mongod"], default="memory")
+    parser.add_argument("--mongod-bin", help="mongod binary to start on a temporary dbpath")
+    parser.add_argument("--mongo-url", help="existing disposable mongod; bench_* databases are dropped")
+    parser.add_argument("--scenario", action="append", help="run only these scenarios (repeatable)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for request counts")
+    parser.add_argument("--out", default=str(REPORT_DIR), help="directory for the JSON report")
+    parser.add_argument("--compare", help="previous JSON report to diff against")
+    args = parser.parse_args()
+
+    print("🚀 Mission Control Backend Benchmarks")
+    print("=" * 50)
+    results = asyncio.run(run(args))
+
+    revision = git_revision()
+    report = {
+        "revision": revision,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "mode": args.mode,
+        "store": args.store,
+        "scale": args.scale,
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = out_dir / f"bench_{stamp}_{revision}.json"
+    path.write_text(json.dumps(report, indent=2) + "\n")
+    print(f"\n💾 Saved {path}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,19 +17,26 @@ const badgeStyles = {
   grey: "bg-zinc-500/15 text-zinc-400 border-zinc-500/20",
 };
 
+const PLACEHOLDER_RE = /\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}/g;
+
+// Keeps the declared variables in step with the placeholders, which the API validates on save.
+const extractVariables = (template) => [...new Set([...template.matchAll(PLACEHOLDER_RE)].map((m) => m[1]))];
+
 const AgentDetailModal = ({ agentId, onClose }) => {
   const [agent, setAgent] = useState(null);
   const [draft, setDraft] = useState(null);
   const [loading, setLoading] = useState(true);
   const [saving, setSaving] = useState(false);
   const [saved, setSaved] = useState(false);
+  const [saveError, setSaveError] = useState(null);
   const [showDiscard, setShowDiscard] = useState(false);
 
   const API = process.env.REACT_APP_BACKEND_URL;
 
-  useEffect(() => {
+  const loadAgent = useCallback(() => {
     if (!agentId) return;
     setLoading(true);
+    setSaveError(null);
     fetch(`${API}/api/agents/${agentId}`)
       .then((r) => r.json())
       .then((data) => {
@@ -40,6 +47,10 @@ const AgentDetailModal = ({ agentId, onClose }) => {
       .catch(() => setLoading(false));
   }, [agentId, API]);
 
+  useEffect(() => {
+    loadAgent();
+  }, [loadAgent]);
+
   const hasChanges = agent && draft && JSON.stringify(agent) !== JSON.stringify(draft);
 
   const handleClose = useCallback(() => {
@@ -56,12 +67,34 @@ const AgentDetailModal = ({ agentId, onClose }) => {
     return () => window.removeEventListener("keydown", handler);
   }, [handleClose]);
 
+  // Turns a failed save into something the footer can show: 409 is a version
+  // conflict, 422 carries the per-template placeholder mismatches.
+  const describeSaveError = async (res) => {
+    if (res.status === 409) {
+      return { message: "Agent was changed elsewhere — reload to edit", conflict: true };
+    }
+    const body = await res.json().catch(() => null);
+    const detail = body?.detail;
+    if (detail?.templates) {
+      return { message: detail.message, templates: detail.templates };
+    }
+    if (typeof detail === "string") return { message: detail };
+    if (Array.isArray(detail) && detail.length) {
+      return { message: detail.map((d) => `${d.loc?.slice(1).join(".")}: ${d.msg}`).join("; ") };
+    }
+    return { message: `Save failed (HTTP ${res.status})` };
+  };
+
   const handleSave = async () => {
     setSaving(true);
+    setSaveError(null);
     try {
       const res = await fetch(`${API}/api/agents/${agentId}`, {
         method: "PUT",
-        headers: { "Content-Type": "application/json" },
+        headers: {
+          "Content-Type": "application/json",
+          "If-Match": `"${agent.version ?? 0}"`,
+        },
         body: JSON.stringify({
           name: draft.name,
           role: draft.role,
@@ -72,13 +105,17 @@ const AgentDetailModal = ({ agentId, onClose }) => {
           status: draft.status,
         }),
       });
+      if (!res.ok) {
+        setSaveError(await describeSaveError(res));
+        return;
+      }
       const updated = await res.json();
       setAgent(updated);
       setDraft(JSON.parse(JSON.stringify(updated)));
       setSaved(true);
       setTimeout(() => setSaved(false), 2000);
     } catch (e) {
-      console.error("Save failed:", e);
+      setSaveError({ message: `Save failed: ${e.message}` });
     } finally {
       setSaving(false);
     }
@@ -92,6 +129,7 @@ const AgentDetailModal = ({ agentId, onClose }) => {
     setDraft((prev) => {
       const prompts = [...prev.promptTemplates];
       prompts[index] = { ...prompts[index], [key]: value };
+      if (key === "template") prompts[index].variables = extractVariables(value);
       return { ...prev, promptTemplates: prompts };
     });
   };
@@ -332,6 +370,37 @@ const AgentDetailModal = ({ agentId, onClose }) => {
           {/* Footer */}
           {draft && (
             <div className="px-7 py-4 border-t border-[var(--mc-border)] shrink-0">
+              {saveError && (
+                <div
+                  data-testid="agent-save-error"
+                  className="mb-3 rounded-lg bg-rose-500/10 border border-rose-500/20 px-3 py-2"
+                >
+                  <div className="flex items-start gap-2">
+                    <AlertTriangle className="w-3.5 h-3.5 text-rose-400 shrink-0 mt-0.5" strokeWidth={1.8} />
+                    <span className="text-[11px] text-rose-400 leading-relaxed flex-1">{saveError.message}</span>
+                    {saveError.conflict && (
+                      <button
+                        data-testid="agent-save-error-reload-btn"
+                        onClick={loadAgent}
+                        className="font-mono text-[9px] tracking-wider text-rose-300 hover:text-rose-200 underline shrink-0"
+                      >
+                        Reload
+                      </button>
+                    )}
+                  </div>
+                  {saveError.templates && (
+                    <ul className="mt-1.5 ml-5 space-y-0.5">
+                      {saveError.templates.map((t) => (
+                        <li key={t.name} className="font-mono text-[9px] text-rose-300/90">
+                          {t.name}
+                          {t.undeclared.length > 0 && ` — undeclared: ${t.undeclared.map((v) => `{{${v}}}`).join(", ")}`}
+                          {t.unused.length > 0 && ` — unused: ${t.unused.map((v) => `{{${v}}}`).join(", ")}`}
+                        </li>
+                      ))}
+                    </ul>
+                  )}
+                </div>
+              )}
               <div className="flex items-center justify-between">
                 <span className="font-mono text-[9px] text-[var(--mc-text-muted)] tracking-wider">
                   {draft.llmProvider} / {draft.llmModel}
@@ -340,7 +409,7 @@ const AgentDetailModal = ({ agentId, onClose }) => {
                   <div className="flex items-center gap-2">
                     <button
                       data-testid="agent-cancel-btn"
-                      onClick={() => setDraft(JSON.parse(JSON.stringify(agent)))}
+                      onClick={() => { setDraft(JSON.parse(JSON.stringify(agent))); setSaveError(null); }}
                       className="font-mono text-[10px] tracking-wider px-4 py-2 rounded-lg text-[var(--mc-text-muted)] hover:text-[var(--mc-text-primary)] hover:bg-[var(--mc-card)] transition-colors"
                     >
                       Cancel
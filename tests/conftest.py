@@ -0,0 +1,20 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+os.environ.setdefault("LLM_FALLBACK_PROVIDER", "stub")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    mock = AsyncMongoMockClient(tz_aware=True)["test_database"]
+    monkeypatch.setattr(server, "db", mock)
+    return mock
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timezone
+
+import server
+
+AT = datetime(2026, 1, 5, 12, 30, 15, tzinfo=timezone.utc)
+
+
+def event(agent_id, type="task_created", at=AT):
+    return {"agentId": agent_id, "type": type, "createdAt": at}
+
+
+def rollup():
+    return server.ActivityRollup(2, 8, interval=300, flush_interval=0.01)
+
+
+def test_record_only_counts_in_memory(db):
+    r = rollup()
+
+    async def run():
+        r.record([event("a"), event("a", "task_moved"), event("b"), event("")])
+        return await db.activity.count_documents({})
+
+    assert asyncio.run(run()) == 0
+    minute = server.bucket_start(AT, "minute")
+    assert r.pending == {
+        ("a", minute): {"task_created": 1, "task_moved": 1},
+        ("b", minute): {"task_created": 1},
+    }
+
+
+def test_flush_merges_into_minute_buckets(db):
+    r = rollup()
+
+    async def run():
+        r.record([event("a"), event("a")])
+        await r.flush()
+        r.record([event("a", "task_moved")])
+        await r.flush()
+        return await db.activity.find({}, {"_id": 0}).to_list(None)
+
+    (doc,) = asyncio.run(run())
+    assert doc["agentId"] == "a" and doc["unit"] == "minute"
+    assert doc["total"] == 3
+    assert doc["counts"] == {"task_created": 2, "task_moved": 1}
+    assert not r.pending
+
+
+def test_failed_buckets_are_kept_for_the_next_flush(db):
+    r = rollup()
+
+    async def run():
+        # Only one bucket per minute may exist, so b's upsert fails and a's lands.
+        await db.activity.create_index([("unit", 1), ("start", 1)], unique=True)
+        r.record([event("a"), event("b")])
+        written = await r.flush()
+        return written, await db.activity.count_documents({})
+
+    assert asyncio.run(run()) == (1, 1)
+    assert r.pending == {("b", server.bucket_start(AT, "minute")): {"task_created": 1}}
+
+
+def test_stop_flushes_pending_counts(db):
+    r = rollup()
+    r.flush_interval = 60
+
+    async def run():
+        r.start()
+        r.record([event("a")])
+        await r.stop()
+        return await db.activity.count_documents({"agentId": "a"})
+
+    assert asyncio.run(run()) == 1
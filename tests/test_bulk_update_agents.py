@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def agent(agent_id, version=1, **extra):
+    return {"id": agent_id, "name": agent_id, "role": "Worker", "badge": "", "badgeColor": "",
+            "status": "WORKING", "icon": "", "version": version, "seq": 0, **extra}
+
+
+def bulk(**body):
+    return asyncio.run(server.bulk_update_agents(server.AgentBulkUpdate.model_validate(body)))
+
+
+@pytest.fixture
+def agents(db):
+    asyncio.run(db.agents.insert_many([agent("a", llmProvider="openai"), agent("b", llmProvider="openai"),
+                                       agent("c", llmProvider="anthropic")]))
+    return db
+
+
+@pytest.mark.parametrize("body", [
+    {"update": {"status": "IDLE"}},
+    {"filter": {}, "update": {"status": "IDLE"}},
+    {"filter": {"status": "WORKING"}},
+    {"items": [{"id": "a", "status": "IDLE"}], "filter": {"ids": ["b"]}, "update": {"status": "IDLE"}},
+    {"items": [{"id": "a", "status": "IDLE"}], "update": {"status": "IDLE"}},
+])
+def test_rejects_ambiguous_bodies(agents, body):
+    with pytest.raises(HTTPException) as e:
+        bulk(**body)
+    assert e.value.status_code == 422
+    assert asyncio.run(agents.agents.count_documents({"status": "IDLE"})) == 0
+
+
+def test_filter_form_updates_only_matches(agents):
+    result = bulk(filter={"llmProvider": "openai"}, update={"status": "IDLE"})
+    assert sorted(u["id"] for u in result["updated"]) == ["a", "b"]
+    assert all(u["version"] == 2 for u in result["updated"])
+    assert asyncio.run(agents.agents.find_one({"id": "c"}))["version"] == 1
+
+
+def test_attributes_writes_overtaken_before_read_back(agents, monkeypatch):
+    collection = type(agents.agents)
+    bulk_write = collection.bulk_write
+
+    async def then_single_put(self, ops, **kwargs):
+        result = await bulk_write(self, ops, **kwargs)
+        # A PUT landing between the bulk write and the read-back replaces seq
+        # but leaves recentSeqs alone.
+        await agents.agents.update_one({"id": "a"}, {"$inc": {"version": 1}, "$set": {"seq": 999}})
+        return result
+
+    monkeypatch.setattr(collection, "bulk_write", then_single_put)
+    result = bulk(items=[{"id": "a", "status": "IDLE", "version": 1}, {"id": "b", "status": "IDLE", "version": 1}])
+
+    assert result["errors"] == []
+    assert result["updated"] == [{"id": "a", "version": 2}, {"id": "b", "version": 2}]
+    doc = asyncio.run(agents.agents.find_one({"id": "a"}))
+    assert doc["seq"] == 999 and doc["version"] == 3
+    assert len(doc["recentSeqs"]) == 1
+
+
+def test_stale_version_is_reported_not_applied(agents):
+    result = bulk(items=[{"id": "a", "status": "IDLE", "version": 5}, {"id": "b", "status": "IDLE", "version": 1}])
+
+    assert result["updated"] == [{"id": "b", "version": 2}]
+    assert result["errors"] == [{"id": "a", "detail": "Agent was modified by another request"}]
+    assert "recentSeqs" not in asyncio.run(agents.agents.find_one({"id": "a"}))
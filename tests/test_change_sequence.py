@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def ago(seconds):
+    return datetime.now(timezone.utc) - timedelta(seconds=seconds)
+
+
+def test_allocate_is_contiguous(db):
+    seq = server.ChangeSequence("agents", grace=5)
+
+    async def run():
+        return [await seq.allocate(), await seq.allocate(3), await seq.allocate()]
+
+    (a, _), (b, _), (c, _) = asyncio.run(run())
+    assert (a, b, c) == (1, 2, 5)
+
+
+def test_high_water_empty(db):
+    assert asyncio.run(server.ChangeSequence("agents", grace=5).high_water()) == (0, 0)
+
+
+def test_high_water_trails_recent_allocations(db):
+    seq = server.ChangeSequence("agents", grace=5)
+
+    async def run():
+        await seq.allocate(4)
+        await db.agents.insert_many([
+            {"id": "a", "seq": 1, "seqAt": ago(60)},
+            {"id": "b", "seq": 2, "seqAt": ago(30)},
+            # 3 is still in flight and 4 committed ahead of it.
+            {"id": "d", "seq": 4, "seqAt": ago(1)},
+        ])
+        return await seq.high_water()
+
+    assert asyncio.run(run()) == (2, 4)
+
+
+def test_high_water_advances_once_grace_passes(db):
+    seq = server.ChangeSequence("agents", grace=5)
+
+    async def run():
+        await seq.allocate(3)
+        await db.agents.insert_many([
+            {"id": "a", "seq": 1, "seqAt": ago(60)},
+            {"id": "c", "seq": 3, "seqAt": ago(6)},
+        ])
+        return await seq.high_water()
+
+    # 2 was abandoned or overwritten; it cannot hold back the mark forever.
+    assert asyncio.run(run()) == (3, 3)
+
+
+def test_high_water_counts_documents_without_allocation_time(db):
+    seq = server.ChangeSequence("agents", grace=5)
+
+    async def run():
+        await seq.allocate(2)
+        await db.agents.insert_many([{"id": "a", "seq": 1}, {"id": "b", "seq": 2, "seqAt": ago(1)}, {"id": "c"}])
+        return await seq.high_water()
+
+    assert asyncio.run(run()) == (1, 2)
@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import mongomock
+import pytest
+
+import server
+
+AGENT = server.AgentDetail(id="a", name="A", role="Worker", badge="", badgeColor="", status="IDLE", icon="",
+                           llmProvider="stub", llmModel="Stub 1", systemInstructions="Be brief.")
+
+
+@pytest.fixture
+def jobs(db, monkeypatch):
+    # mongomock drops the fields of the updated document when find_one_and_update
+    # combines an exclusion projection with ReturnDocument.AFTER.
+    find_and_modify = mongomock.collection.Collection._find_and_modify
+
+    def _find_and_modify(self, query, projection=None, *args, **kwargs):
+        if projection != {"_id": 0}:
+            return find_and_modify(self, query, projection, *args, **kwargs)
+        doc = find_and_modify(self, query, None, *args, **kwargs)
+        if doc is not None:
+            doc.pop("_id", None)
+        return doc
+
+    monkeypatch.setattr(mongomock.collection.Collection, "_find_and_modify", _find_and_modify)
+
+    async def get(agent_id):
+        return AGENT if agent_id == AGENT.id else None
+
+    monkeypatch.setattr(server.agent_cache, "get", get)
+    monkeypatch.setitem(server.llm_providers, "stub", server.StubProvider(0, 0.0))
+
+    async def indexes():
+        await db.jobs.create_index("id", unique=True)
+        await db.jobs.create_index("activeKey", unique=True, sparse=True)
+
+    asyncio.run(indexes())
+    return db
+
+
+def runner():
+    r = server.JobRunner(1, {}, {}, lease=30, timeout=5)
+    r.backoff = lambda attempt, retry_after: 0
+    return r
+
+
+def submit(prompt="Summarize the standup.", max_attempts=3):
+    return server.create_job(server.JobCreate(agentId="a", prompt=prompt, maxAttempts=max_attempts))
+
+
+async def stored(db, job_id):
+    return await db.jobs.find_one({"id": job_id}, {"_id": 0})
+
+
+def test_retries_after_injected_failure(jobs):
+    r = runner()
+
+    async def run():
+        created = await submit()
+        server.llm_providers["stub"].failure_rate = 1.0
+        await r.execute((await r.claim())[0])
+        retried = await stored(jobs, created["id"])
+        server.llm_providers["stub"].failure_rate = 0.0
+        await r.execute((await r.claim())[0])
+        return retried, await stored(jobs, created["id"])
+
+    retried, done = asyncio.run(run())
+    assert retried["status"] == "queued"
+    assert retried["attempts"] == 1
+    assert retried["error"] == "stub: injected failure"
+    assert "leaseToken" not in retried
+    assert done["status"] == "succeeded" and done["attempts"] == 2
+    assert done["result"]["text"].startswith("[Stub 1:")
+    assert "activeKey" not in done
+
+
+def test_fails_once_attempts_are_spent(jobs):
+    r = runner()
+    server.llm_providers["stub"].failure_rate = 1.0
+
+    async def run():
+        created = await submit(max_attempts=2)
+        for _ in range(2):
+            await r.execute((await r.claim())[0])
+        return await stored(jobs, created["id"]), await r.claim()
+
+    done, (again, _) = asyncio.run(run())
+    assert done["status"] == "failed" and done["attempts"] == 2
+    assert "activeKey" not in done
+    assert again is None
+
+
+def test_coalesces_identical_prompts_while_active(jobs):
+    r = runner()
+
+    async def run():
+        first = await submit()
+        same = await submit()
+        other = await submit("Something else.")
+        await r.execute((await r.claim())[0])
+        # Coalescing only holds while the first job is queued or running.
+        after = await submit()
+        return first, same, other, after
+
+    first, same, other, after = asyncio.run(run())
+    assert first["coalesced"] is False
+    assert same["coalesced"] is True and same["id"] == first["id"]
+    assert other["coalesced"] is False and other["id"] != first["id"]
+    assert after["coalesced"] is False and after["id"] != first["id"]
+
+
+def expired_job(attempts, max_attempts=3):
+    now = datetime.now(timezone.utc)
+    return {"id": "j1", "agentId": "a", "provider": "stub", "model": "Stub 1", "modelKey": "stub/Stub 1",
+            "system": "", "prompt": "Ping", "status": "running", "attempts": attempts,
+            "maxAttempts": max_attempts, "runAt": now - timedelta(minutes=5), "leaseToken": "lost",
+            "leaseUntil": now - timedelta(seconds=1), "activeKey": "k1"}
+
+
+def test_reclaims_expired_lease(jobs):
+    r = runner()
+
+    async def run():
+        await jobs.jobs.insert_one(expired_job(attempts=1))
+        job, _ = await r.claim()
+        stale = await r.finish({"id": "j1", "leaseToken": "lost"}, {"$set": {"status": "failed"}})
+        await r.execute(job)
+        return job, stale, await stored(jobs, "j1")
+
+    job, stale, done = asyncio.run(run())
+    assert job["attempts"] == 2 and job["leaseToken"] != "lost"
+    assert stale is False
+    assert done["status"] == "succeeded"
+
+
+def test_fails_job_whose_lease_lapsed_on_every_attempt(jobs):
+    r = runner()
+
+    async def run():
+        await jobs.jobs.insert_one(expired_job(attempts=3))
+        await r.execute((await r.claim())[0])
+        return await stored(jobs, "j1")
+
+    done = asyncio.run(run())
+    assert done["status"] == "failed" and done["attempts"] == 4
+    assert done["error"] == "Lease expired on every attempt"
+    assert "activeKey" not in done
+
+
+def test_cancel_hands_job_back_without_spending_attempt(jobs):
+    r = runner()
+    server.llm_providers["stub"].latency = 10
+
+    async def run():
+        created = await submit()
+        task = asyncio.create_task(r.execute((await r.claim())[0]))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await stored(jobs, created["id"])
+
+    job = asyncio.run(run())
+    assert job["status"] == "queued" and job["attempts"] == 0
+    assert "leaseToken" not in job and "leaseUntil" not in job
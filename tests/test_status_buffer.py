@@ -0,0 +1,114 @@
+import asyncio
+import uuid
+
+from pymongo.errors import OperationFailure
+
+import server
+
+
+def check(**extra):
+    return {"id": str(uuid.uuid4()), "client_name": "probe", "timestamp": server.now_millis(), **extra}
+
+
+def test_flushes_when_batch_is_full(db):
+    async def run():
+        buf = server.StatusWriteBuffer(max_batch=3, interval=10, max_queue=100)
+        buf.start()
+        await asyncio.wait_for(asyncio.gather(*(buf.submit(check()) for _ in range(3))), 1)
+        stats = buf.stats()
+        await buf.stop()
+        return stats, await db.status_checks.count_documents({})
+
+    stats, count = asyncio.run(run())
+    assert (stats["flushes"], stats["flushed"], count) == (1, 3, 3)
+
+
+def test_flushes_partial_batch_after_interval(db):
+    async def run():
+        buf = server.StatusWriteBuffer(max_batch=100, interval=0.05, max_queue=100)
+        buf.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.wait_for(buf.submit(check()), 1)
+        elapsed = loop.time() - started
+        await buf.stop()
+        return elapsed, await db.status_checks.count_documents({})
+
+    elapsed, count = asyncio.run(run())
+    assert elapsed >= 0.04
+    assert count == 1
+
+
+def test_fire_returns_before_the_flush(db):
+    async def run():
+        buf = server.StatusWriteBuffer(max_batch=100, interval=10, max_queue=100)
+        buf.start()
+        await buf.submit(check(), wait=False)
+        queued = await db.status_checks.count_documents({})
+        await buf.stop()
+        return queued, await db.status_checks.count_documents({})
+
+    assert asyncio.run(run()) == (0, 1)
+
+
+def test_write_error_reaches_only_its_submitter(db):
+    async def run():
+        await db.status_checks.create_index("id", unique=True)
+        await db.status_checks.insert_one(check(id="taken"))
+        buf = server.StatusWriteBuffer(max_batch=2, interval=10, max_queue=100)
+        buf.start()
+        results = await asyncio.wait_for(
+            asyncio.gather(buf.submit(check(id="taken")), buf.submit(check(id="fresh")), return_exceptions=True), 1)
+        stats = buf.stats()
+        await buf.stop()
+        return results, stats
+
+    (dup, ok), stats = asyncio.run(run())
+    assert isinstance(dup, OperationFailure)
+    assert ok is None
+    assert (stats["flushed"], stats["failed"]) == (1, 1)
+
+
+def test_stop_drains_submitters_blocked_on_a_full_queue(db):
+    async def run():
+        buf = server.StatusWriteBuffer(max_batch=5, interval=0.01, max_queue=3)
+        buf.start()
+        submits = [asyncio.create_task(buf.submit(check())) for _ in range(40)]
+        await asyncio.sleep(0)
+        await buf.stop()
+        await asyncio.wait_for(asyncio.gather(*submits), 1)
+        return await db.status_checks.count_documents({})
+
+    assert asyncio.run(run()) == 40
+
+
+def test_stop_flushes_checks_queued_behind_the_sentinel(db, monkeypatch):
+    async def run():
+        buf = server.StatusWriteBuffer(max_batch=5, interval=0.01, max_queue=3)
+        buf.start()
+        late = asyncio.get_running_loop().create_future()
+        put = buf.queue.put
+
+        async def put_then_race(item):
+            await put(item)
+            if item is None:
+                # A submitter that was blocked on the full queue lands after the sentinel.
+                buf.queue.put_nowait((check(id="late"), late))
+
+        monkeypatch.setattr(buf.queue, "put", put_then_race)
+        await buf.stop()
+        await asyncio.wait_for(late, 1)
+        return await db.status_checks.count_documents({"id": "late"})
+
+    assert asyncio.run(run()) == 1
+
+
+def test_submit_after_stop_writes_directly(db):
+    async def run():
+        buf = server.StatusWriteBuffer(max_batch=5, interval=0.01, max_queue=3)
+        buf.start()
+        await buf.stop()
+        await buf.submit(check())
+        return await db.status_checks.count_documents({})
+
+    assert asyncio.run(run()) == 1
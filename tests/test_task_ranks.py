@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from server import is_valid_rank, rank_between
+
+
+def test_first_rank():
+    assert rank_between(None, None) == "a0"
+
+
+def test_repeated_appends_stay_short():
+    ranks = [rank_between(None, None)]
+    for _ in range(20000):
+        ranks.append(rank_between(ranks[-1], None))
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == len(ranks)
+    assert max(len(r) for r in ranks) <= 4
+
+
+def test_repeated_prepends_stay_short():
+    ranks = [rank_between(None, None)]
+    for _ in range(20000):
+        ranks.append(rank_between(None, ranks[-1]))
+    ranks.reverse()
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == len(ranks)
+    assert max(len(r) for r in ranks) <= 4
+
+
+def test_random_inserts_keep_order():
+    rng = random.Random(7)
+    ranks = [rank_between(None, None)]
+    for _ in range(5000):
+        i = rng.randint(0, len(ranks))
+        lo = ranks[i - 1] if i > 0 else None
+        hi = ranks[i] if i < len(ranks) else None
+        rank = rank_between(lo, hi)
+        assert (lo is None or lo < rank) and (hi is None or rank < hi)
+        assert is_valid_rank(rank)
+        ranks.insert(i, rank)
+    assert ranks == sorted(ranks)
+    assert len(set(ranks)) == len(ranks)
+
+
+def test_repeated_inserts_between_neighbours():
+    lo, hi = "a0", "a1"
+    for _ in range(1000):
+        mid = rank_between(lo, hi)
+        assert lo < mid < hi
+        hi = mid
+
+
+def test_rejects_out_of_order_neighbours():
+    with pytest.raises(ValueError):
+        rank_between("a1", "a0")
+    with pytest.raises(ValueError):
+        rank_between("a0", "a0")
+
+
+@pytest.mark.parametrize("rank", ["", "V", "a", "a10", "b0", "a0!", None])
+def test_invalid_ranks(rank):
+    assert not is_valid_rank(rank)